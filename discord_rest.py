@@ -0,0 +1,193 @@
+"""
+Discord REST client shared by the polling and gateway bots
+Tracks per-route rate limit buckets and the global limit, and retries 429s honoring Retry-After
+and server or connection errors with backoff
+"""
+
+import re
+import time
+import random
+import threading
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DISCORD_API_BASE = "https://discord.com/api/v10"
+GLOBAL_RATE_LIMIT = 50  # Requests per second Discord allows a bot across all routes
+MAX_RETRIES = 5  # Attempts per request on 429 / 5xx / connection errors before giving up
+REQUEST_TIMEOUT = (5, 30)  # Connect and read timeouts in seconds, so a dead connection can't hang a worker
+
+# IDs that Discord treats as "major parameters": each value gets its own bucket
+MAJOR_PARAMETER = re.compile(r"/(channels|guilds|webhooks)/(\d+)")
+SNOWFLAKE = re.compile(r"\d{15,21}")
+
+class RateLimitBucket:
+    """Remaining request count for one bucket and when it resets"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.remaining = None  # Unknown until the first response
+        self.reset_at = 0.0  # Monotonic time the bucket refills
+
+    def acquire(self):
+        """Block until the bucket has a request available, then take it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if self.remaining is None or self.remaining > 0 or self.reset_at <= now:
+                    if self.remaining is not None:
+                        self.remaining = self.remaining - 1 if self.reset_at > now else None
+                    return
+                wait = self.reset_at - now
+            time.sleep(wait)
+
+    def update(self, remaining, reset_after):
+        """Record the bucket state from response headers"""
+        with self.lock:
+            self.remaining = remaining
+            self.reset_at = time.monotonic() + reset_after
+
+    def exhaust(self, retry_after):
+        """Mark the bucket empty until retry_after seconds from now"""
+        self.update(0, retry_after)
+
+class GlobalRateLimiter:
+    """Sliding one-second window over every request, plus global 429 lockouts"""
+
+    def __init__(self, rate=GLOBAL_RATE_LIMIT):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.sent = deque()  # Monotonic send times within the last second
+        self.blocked_until = 0.0
+
+    def acquire(self):
+        """Block until a request may be sent without exceeding the global limit"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                while self.sent and now - self.sent[0] >= 1.0:
+                    self.sent.popleft()
+
+                if self.blocked_until > now:
+                    wait = self.blocked_until - now
+                elif len(self.sent) >= self.rate:
+                    wait = 1.0 - (now - self.sent[0])
+                else:
+                    self.sent.append(now)
+                    return
+            time.sleep(wait)
+
+    def block(self, retry_after):
+        """Hold every request for retry_after seconds after a global 429"""
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+
+class DiscordREST:
+    """Thread-safe Discord REST client with bucket-aware rate limiting"""
+
+    def __init__(self, token, pool_size=10):
+        self.session = requests.Session()
+        self.session.headers.update({
+            "Authorization": f"Bot {token}",
+            "Content-Type": "application/json"
+        })
+        # Size the connection pool so concurrent callers reuse keep-alive connections
+        self.session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
+
+        self.global_limiter = GlobalRateLimiter()
+        self.lock = threading.Lock()
+        self.route_buckets = {}  # route key -> bucket hash reported by Discord
+        self.buckets = {}  # bucket key -> RateLimitBucket
+
+    @staticmethod
+    def route_key(method, path):
+        """Route identity for rate limiting: method plus path with minor IDs masked"""
+        major = MAJOR_PARAMETER.search(path)
+        masked = SNOWFLAKE.sub("{id}", path)
+        if major:
+            masked = masked.replace(f"/{major.group(1)}/{{id}}", f"/{major.group(1)}/{major.group(2)}", 1)
+        return f"{method} {masked}"
+
+    def get_bucket(self, route):
+        """Bucket for a route, keyed by Discord's bucket hash once it's known"""
+        with self.lock:
+            bucket_hash = self.route_buckets.get(route)
+            if bucket_hash:
+                major = MAJOR_PARAMETER.search(route)
+                key = f"{bucket_hash}:{major.group(2) if major else ''}"
+            else:
+                key = route
+
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = RateLimitBucket()
+            return bucket
+
+    def request(self, method, path, **kwargs):
+        """Send a request, waiting for rate limits and retrying 429s, server errors and connection failures"""
+        route = self.route_key(method, path)
+        kwargs.setdefault("timeout", REQUEST_TIMEOUT)
+
+        for attempt in range(MAX_RETRIES):
+            bucket = self.get_bucket(route)
+            bucket.acquire()
+            self.global_limiter.acquire()
+
+            try:
+                response = self.session.request(method, f"{DISCORD_API_BASE}{path}", **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == MAX_RETRIES - 1:
+                    print(f"❌ Giving up on {route} after {MAX_RETRIES} attempts: {e}")
+                    raise
+                print(f"⚠️  {route} failed ({type(e).__name__}), retrying")
+                time.sleep(min(2 ** attempt, 10) + random.random())
+                continue
+            headers = response.headers
+
+            bucket_hash = headers.get("X-RateLimit-Bucket")
+            if bucket_hash:
+                with self.lock:
+                    self.route_buckets[route] = bucket_hash
+                bucket = self.get_bucket(route)
+
+            if "X-RateLimit-Remaining" in headers and "X-RateLimit-Reset-After" in headers:
+                bucket.update(int(headers["X-RateLimit-Remaining"]), float(headers["X-RateLimit-Reset-After"]))
+
+            if response.status_code == 429:
+                retry_after, is_global = self.parse_429(response)
+                if is_global:
+                    print(f"⏳ Global rate limit hit, pausing all requests for {retry_after:.2f}s")
+                    self.global_limiter.block(retry_after)
+                else:
+                    print(f"⏳ Rate limited on {route}, retrying in {retry_after:.2f}s")
+                    bucket.exhaust(retry_after)
+                continue
+
+            if response.status_code >= 500:
+                # Discord's edge occasionally 502s; back off briefly and retry
+                time.sleep(min(2 ** attempt, 10) + random.random())
+                continue
+
+            return response
+
+        print(f"❌ Giving up on {route} after {MAX_RETRIES} attempts: {response.status_code}")
+        return response
+
+    @staticmethod
+    def parse_429(response):
+        """Seconds to wait after a 429 and whether the limit is global"""
+        headers = response.headers
+        is_global = bool(headers.get("X-RateLimit-Global")) or headers.get("X-RateLimit-Scope") == "global"
+        try:
+            body = response.json()
+            return float(body["retry_after"]), is_global or bool(body.get("global"))
+        except (ValueError, KeyError, TypeError):
+            # Cloudflare-level 429s come without a JSON body
+            return float(headers.get("Retry-After", 1)), is_global
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Playlist Export Script
+Streams a playlist to JSONL or CSV page by page, so memory use stays flat no matter how long the playlist is.
+Run setup_spotify.py first so a cached token exists.
+"""
+
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import tempfile
+from datetime import date
+
+from dotenv import load_dotenv
+
+from playlist import PLAYLIST_ID, playlist_pages
+from spotify_async import AsyncSpotify
+from spotify_auth import TokenManager
+
+# Only the fields that go into the export
+EXPORT_FIELDS = ("total,items(added_at,added_by(id),is_local,"
+                 "track(uri,id,name,duration_ms,artists(name),album(name,release_date),external_urls))")
+CSV_COLUMNS = ["position", "added_at", "added_by", "uri", "name", "artists", "album", "release_date",
+               "duration_ms", "is_local", "url"]
+
+def export_row(position, item):
+    """Flat record for one playlist item; removed tracks keep their position with empty details"""
+    track = item.get('track') or {}
+    album = track.get('album') or {}
+    return {
+        "position": position,
+        "added_at": item.get('added_at'),
+        "added_by": (item.get('added_by') or {}).get('id'),
+        "uri": track.get('uri'),
+        "name": track.get('name'),
+        "artists": "; ".join(artist['name'] for artist in track.get('artists') or []),
+        "album": album.get('name'),
+        "release_date": album.get('release_date'),
+        "duration_ms": track.get('duration_ms'),
+        "is_local": item.get('is_local', False),
+        "url": (track.get('external_urls') or {}).get('spotify')
+    }
+
+class ExportWriter:
+    """Appends rows to a temp file next to the output and moves it into place only once the export finishes"""
+
+    def __init__(self, path, fmt):
+        self.path = path
+        self.fmt = fmt
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, self.tmp_path = tempfile.mkstemp(dir=directory, prefix=".export.", suffix=".tmp")
+        self.file = os.fdopen(fd, "w", newline="", encoding="utf-8")
+        self.csv = None
+        if fmt == "csv":
+            self.csv = csv.DictWriter(self.file, fieldnames=CSV_COLUMNS)
+            self.csv.writeheader()
+
+    def write_rows(self, rows):
+        if self.csv:
+            self.csv.writerows(rows)
+        else:
+            self.file.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+    def commit(self):
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        os.unlink(self.tmp_path)
+
+async def export_playlist(spotify, playlist_id, path, fmt):
+    """Write every item of the playlist to path; returns how many were written"""
+    loop = asyncio.get_running_loop()
+    writer = ExportWriter(path, fmt)
+    written = 0
+    try:
+        # playlist_pages already has the next page in flight; writing in an executor keeps the loop free to receive it
+        async for items in playlist_pages(spotify, playlist_id, fields=EXPORT_FIELDS):
+            rows = [export_row(written + i, item) for i, item in enumerate(items)]
+            await loop.run_in_executor(None, writer.write_rows, rows)
+            written += len(rows)
+            print(f"   {written} track(s) written...", end="\r")
+    except BaseException:
+        writer.abort()
+        raise
+    writer.commit()
+    return written
+
+async def run_export(playlist_id, path, fmt):
+    tokens = TokenManager(os.getenv("SPOTIFY_CLIENT_ID"), os.getenv("SPOTIFY_CLIENT_SECRET"))
+    if not tokens.token_info:
+        print("❌ No cached Spotify token found. Run setup_spotify.py first.")
+        return False
+
+    spotify = AsyncSpotify(tokens)
+    try:
+        written = await export_playlist(spotify, playlist_id, path, fmt)
+    finally:
+        await spotify.close()
+    print(f"\n✅ Exported {written} track(s) to {path}")
+    return True
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Export a Spotify playlist to JSONL or CSV")
+    parser.add_argument("-p", "--playlist", default=PLAYLIST_ID, help="Playlist ID (default: the Discord playlist)")
+    parser.add_argument("-o", "--output", help="Output file (default: playlist_<id>_<date>.<format>)")
+    parser.add_argument("-f", "--format", choices=["jsonl", "csv"],
+                        help="Output format (default: from the output file's extension, else jsonl)")
+    args = parser.parse_args()
+
+    fmt = args.format
+    if fmt is None:
+        fmt = "csv" if args.output and args.output.lower().endswith(".csv") else "jsonl"
+    path = args.output or f"playlist_{args.playlist}_{date.today():%Y-%m-%d}.{fmt}"
+
+    print(f"📤 Exporting playlist {args.playlist} to {path}")
+    try:
+        return asyncio.run(run_export(args.playlist, path, fmt))
+    except Exception as e:
+        print(f"\n❌ Export failed: {e}")
+        return False
+
+if __name__ == "__main__":
+    if not main():
+        sys.exit(1)
@@ -8,19 +8,34 @@ import os
 import sys
 import json
 import time
-import requests
+import random
 import websocket
 import threading
+import queue
+import zlib
 from dotenv import load_dotenv
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
 from datetime import datetime
+from spotify_async import AsyncSpotify, BackgroundLoop
+from playback import PlaybackWatcher
+from spotify_auth import TokenManager
+from history import ListeningHistory, HistoryIngester, parse_lastplayed_args, format_plays
+from stats import ListeningStats, render_stats
+from discord_rest import DiscordREST
 
 load_dotenv()
 
 # Discord configuration
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
-DISCORD_API_BASE = "https://discord.com/api/v10"
+RECONNECT_BASE_DELAY = 1  # Seconds; doubled per consecutive failed reconnect
+RECONNECT_MAX_DELAY = 60
+COMMAND_WORKERS = int(os.getenv("COMMAND_WORKERS", "4"))  # Threads executing commands
+COMMAND_QUEUE_SIZE = int(os.getenv("COMMAND_QUEUE_SIZE", "100"))  # Pending commands per worker
+# Close codes after which reconnecting can't succeed (bad token, intents, shard config)
+FATAL_CLOSE_CODES = {4004, 4010, 4011, 4012, 4013, 4014}
+# Close codes that invalidate the session, so the next connection must IDENTIFY
+SESSION_CLOSE_CODES = {4007, 4009}
 
 # Spotify authentication setup
 def create_spotify_client():
@@ -37,7 +52,8 @@ def create_spotify_client():
                     client_id=os.getenv("SPOTIFY_CLIENT_ID"),
                     client_secret=os.getenv("SPOTIFY_CLIENT_SECRET"),
                     redirect_uri=os.getenv("SPOTIFY_REDIRECT_URI"),
-                    scope="user-library-read user-read-recently-played user-read-currently-playing user-read-playback-state user-read-playback-position playlist-modify-public playlist-modify-private"
+                    scope="user-library-read user-read-recently-played user-read-currently-playing user-read-playback-state user-read-playback-position playlist-modify-public playlist-modify-private",
+                    cache_handler=token_manager
                 )
                 auth_manager._save_token_info(token_info)
                 return spotipy.Spotify(auth_manager=auth_manager)
@@ -50,7 +66,7 @@ def create_spotify_client():
             client_secret=os.getenv("SPOTIFY_CLIENT_SECRET"),
             redirect_uri=os.getenv("SPOTIFY_REDIRECT_URI"),
             scope="user-library-read user-read-recently-played user-read-currently-playing user-read-playback-state user-read-playback-position playlist-modify-public playlist-modify-private",
-            cache_path=".spotify_cache",
+            cache_handler=token_manager,
             open_browser=False
         )
         
@@ -98,26 +114,133 @@ def create_spotify_client():
         print(f"Error creating Spotify client: {e}")
         return None
 
+# Token lives in memory and is refreshed in the background; spotipy reads it through the cache handler
+token_manager = TokenManager(os.getenv("SPOTIFY_CLIENT_ID"), os.getenv("SPOTIFY_CLIENT_SECRET"))
+
 # Initialize Spotify client
 sp = create_spotify_client()
 
+# Spotify calls run as coroutines on one background loop shared by every command thread
+SPOTIFY_CONCURRENCY = int(os.getenv("SPOTIFY_CONCURRENCY", "8"))
+spotify_loop = BackgroundLoop()
+aspotify = AsyncSpotify(token_manager, concurrency=SPOTIFY_CONCURRENCY) if sp else None
+playback_watcher = PlaybackWatcher(aspotify) if aspotify else None
+listening_history = ListeningHistory()
+history_ingester = HistoryIngester(aspotify, listening_history) if aspotify else None
+listening_stats = ListeningStats(listening_history)
+
+class GatewayHeartbeat:
+    """Heartbeat for a single gateway connection, with ACK tracking and zombie detection"""
+    
+    def __init__(self, ws, interval, get_sequence, on_zombie):
+        self.ws = ws
+        self.interval = interval
+        self.get_sequence = get_sequence
+        self.on_zombie = on_zombie
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.last_sent = None  # Monotonic time of the last heartbeat sent
+        self.acked = True
+        self.latency = None  # Seconds between the last heartbeat and its ACK
+        self.thread = threading.Thread(target=self.run, name="gateway-heartbeat", daemon=True)
+    
+    def start(self):
+        self.thread.start()
+    
+    def stop(self):
+        self.stop_event.set()
+    
+    def beat(self):
+        """Send a heartbeat now"""
+        with self.lock:
+            self.last_sent = time.monotonic()
+            self.acked = False
+        self.ws.send(json.dumps({"op": 1, "d": self.get_sequence()}))
+    
+    def ack(self):
+        """Record a heartbeat ACK (op 11) and the round-trip latency"""
+        with self.lock:
+            self.acked = True
+            if self.last_sent is not None:
+                self.latency = time.monotonic() - self.last_sent
+        if self.latency is not None:
+            print(f"💓 Heartbeat ACK, gateway latency {self.latency * 1000:.0f}ms")
+    
+    def run(self):
+        # The first beat is jittered so reconnecting clients don't heartbeat in lockstep
+        if self.stop_event.wait(self.interval * random.random()):
+            return
+        
+        while True:
+            with self.lock:
+                zombie = not self.acked
+            if zombie:
+                print("⚠️  No heartbeat ACK since the last beat, connection is a zombie; reconnecting...")
+                self.on_zombie()
+                return
+            
+            try:
+                self.beat()
+            except Exception as e:
+                print(f"Heartbeat error: {e}")
+                return
+            
+            if self.stop_event.wait(self.interval):
+                return
+
+class CommandDispatcher:
+    """Bounded worker pool that runs commands off the gateway thread, in order per channel"""
+    
+    def __init__(self, handler, workers=COMMAND_WORKERS, queue_size=COMMAND_QUEUE_SIZE):
+        self.handler = handler
+        # One queue per worker; a channel always maps to the same worker, which keeps its commands in order
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.threads = [
+            threading.Thread(target=self.worker, args=(q,), name=f"command-worker-{i}", daemon=True)
+            for i, q in enumerate(self.queues)
+        ]
+    
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+    
+    def submit(self, channel_id, message_data):
+        """Queue a message for its channel's worker; returns False if that worker is backed up"""
+        q = self.queues[zlib.crc32(str(channel_id).encode()) % len(self.queues)]
+        try:
+            q.put_nowait(message_data)
+            return True
+        except queue.Full:
+            return False
+    
+    def worker(self, q):
+        while True:
+            message_data = q.get()
+            try:
+                self.handler(message_data)
+            except Exception as e:
+                print(f"Error in command worker: {e}")
+            finally:
+                q.task_done()
+
 class DiscordBot:
     def __init__(self, token):
         self.token = token
-        self.headers = {
-            "Authorization": f"Bot {token}",
-            "Content-Type": "application/json"
-        }
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
+        self.rest = DiscordREST(token)
         self.ws = None
         self.sequence = None
         self.heartbeat_interval = None
-        self.last_heartbeat = 0
+        self.heartbeat = None  # GatewayHeartbeat for the current connection
+        self.dispatcher = CommandDispatcher(self.on_message)
+        self.gateway_url = None
+        self.session_id = None  # From READY; lets a reconnect RESUME instead of IDENTIFY
+        self.resume_gateway_url = None
+        self.reconnect_attempts = 0
+        self.running = False
         
     def get_gateway_url(self):
         """Get the WebSocket gateway URL"""
-        response = self.session.get(f"{DISCORD_API_BASE}/gateway")
+        response = self.rest.get("/gateway")
         if response.status_code == 200:
             return response.json()["url"]
         else:
@@ -129,10 +252,7 @@ class DiscordBot:
         if embed:
             data["embeds"] = [embed]
         
-        response = self.session.post(
-            f"{DISCORD_API_BASE}/channels/{channel_id}/messages",
-            json=data
-        )
+        response = self.rest.post(f"/channels/{channel_id}/messages", json=data)
         
         if response.status_code == 200:
             return response.json()
@@ -194,14 +314,47 @@ class DiscordBot:
                     return
                 
                 try:
-                    recent_tracks = sp.current_user_recently_played(limit=1)
+                    mode, value = parse_lastplayed_args(args)
+                except ValueError as e:
+                    self.send_message(channel_id, f"❌ {e}")
+                    return
+                
+                try:
+                    if mode == 'date':
+                        plays = listening_history.on_date(value)
+                        if not plays:
+                            self.send_message(channel_id, f"No plays recorded on {value}.")
+                            return
+                        
+                        embed = self.create_embed(
+                            title=f"📼 Played on {value}",
+                            description=format_plays(plays),
+                            footer={"text": f"{len(plays)} play(s) from listening history"}
+                        )
+                        self.send_message(channel_id, "", embed=embed)
+                        return
                     
-                    if not recent_tracks['items']:
+                    # Answer from local history; fall back to Spotify until the first sync has run
+                    plays = listening_history.last(value)
+                    if not plays:
+                        recent_tracks = spotify_loop.run(aspotify.current_user_recently_played(limit=min(value, 50)))
+                        plays = recent_tracks['items']
+                    
+                    if not plays:
                         self.send_message(channel_id, "No recently played tracks found.")
                         return
                     
-                    track = recent_tracks['items'][0]['track']
-                    played_at = recent_tracks['items'][0]['played_at']
+                    if value > 1:
+                        embed = self.create_embed(
+                            title=f"📼 Last {len(plays)} Played Songs",
+                            description=format_plays(plays),
+                            footer={"text": "Powered by Spotify API"}
+                        )
+                        self.send_message(channel_id, "", embed=embed)
+                        return
+                    
+                    track = plays[0]['track']
+                    played_at = plays[0]['played_at']
                     
                     played_time = datetime.fromisoformat(played_at.replace('Z', '+00:00'))
                     formatted_time = played_time.strftime("%Y-%m-%d %H:%M:%S")
@@ -237,7 +390,7 @@ class DiscordBot:
                     return
                 
                 try:
-                    current_track = sp.current_playback()
+                    current_track = spotify_loop.run(playback_watcher.current())
                     
                     if not current_track or not current_track['is_playing']:
                         self.send_message(channel_id, "🎵 No song is currently playing.")
@@ -269,10 +422,35 @@ class DiscordBot:
                     self.send_message(channel_id, f"❌ Error fetching current song: {str(e)}")
                     print(f"Error in nowplaying command: {e}")
             
+            elif command == "ping":
+                latency = self.latency
+                if latency is None:
+                    self.send_message(channel_id, "🏓 Pong! Gateway latency not measured yet.")
+                else:
+                    self.send_message(channel_id, f"🏓 Pong! Gateway latency: **{latency * 1000:.0f}ms**")
+            
+            elif command == "stats":
+                try:
+                    title, description = render_stats(listening_stats, args)
+                except ValueError as e:
+                    self.send_message(channel_id, f"❌ {e}")
+                    return
+                except Exception as e:
+                    self.send_message(channel_id, f"❌ Error computing listening stats: {str(e)}")
+                    print(f"Error in stats command: {e}")
+                    return
+                
+                embed = self.create_embed(
+                    title=title,
+                    description=description,
+                    footer={"text": "From local listening history"}
+                )
+                self.send_message(channel_id, "", embed=embed)
+            
             elif command == "spotify_status":
                 if sp:
                     try:
-                        user = sp.current_user()
+                        user = spotify_loop.run(aspotify.current_user())
                         self.send_message(channel_id, f"✅ Spotify connected! Logged in as: **{user['display_name']}**")
                     except Exception as e:
                         self.send_message(channel_id, f"❌ Spotify client error: {str(e)}")
@@ -300,46 +478,87 @@ class DiscordBot:
                 self.heartbeat_interval = d['heartbeat_interval'] / 1000
                 print(f"Received heartbeat interval: {self.heartbeat_interval}s")
                 
-                # Start heartbeat thread
-                threading.Thread(target=self.heartbeat_loop, daemon=True).start()
+                # Exactly one heartbeat per connection; stop any left from a previous one
+                self.stop_heartbeat()
+                self.heartbeat = GatewayHeartbeat(
+                    ws,
+                    self.heartbeat_interval,
+                    get_sequence=lambda: self.sequence,
+                    on_zombie=lambda: self.reconnect(resume=True)
+                )
+                self.heartbeat.start()
+            
+            elif op == 11:  # Heartbeat ACK
+                if self.heartbeat:
+                    self.heartbeat.ack()
+            
+            elif op == 1:  # Heartbeat request
+                if self.heartbeat:
+                    self.heartbeat.beat()
             
             elif op == 0:  # Dispatch
                 t = data.get('t')
-                if t == 'MESSAGE_CREATE':
-                    self.on_message(d)
+                if t == 'READY':
+                    self.session_id = d['session_id']
+                    self.resume_gateway_url = d['resume_gateway_url']
+                    self.reconnect_attempts = 0
+                    print(f"✅ Gateway session ready: {self.session_id}")
+                elif t == 'RESUMED':
+                    self.reconnect_attempts = 0
+                    print("✅ Gateway session resumed")
+                elif t == 'MESSAGE_CREATE':
+                    self.dispatch_message(d)
+            
+            elif op == 7:  # Reconnect
+                print("🔄 Gateway requested reconnect, resuming...")
+                self.reconnect(resume=True)
+            
+            elif op == 9:  # Invalid Session
+                resumable = bool(d)
+                print(f"⚠️  Invalid session (resumable: {resumable})")
+                # Discord asks clients to wait 1-5 seconds before re-identifying
+                time.sleep(random.uniform(1, 5))
+                self.reconnect(resume=resumable)
             
         except Exception as e:
             print(f"Error processing WebSocket message: {e}")
     
-    def heartbeat_loop(self):
-        """Send heartbeat messages"""
-        while True:
-            try:
-                if self.heartbeat_interval is None:
-                    print("Heartbeat interval not set, stopping heartbeat loop")
-                    break
-                    
-                time.sleep(float(self.heartbeat_interval))
-                if self.ws and self.ws.sock:
-                    heartbeat = {
-                        "op": 1,
-                        "d": self.sequence
-                    }
-                    self.ws.send(json.dumps(heartbeat))
-                    print("Sent heartbeat")
-            except Exception as e:
-                print(f"Heartbeat error: {e}")
-                break
-    
-    def connect(self):
-        """Connect to Discord Gateway"""
-        gateway_url = self.get_gateway_url()
-        ws_url = f"{gateway_url}?v=10&encoding=json"
+    def dispatch_message(self, message_data):
+        """Hand a command to the worker pool; the gateway thread never runs it inline"""
+        if message_data.get('author', {}).get('bot', False):
+            return
+        if not message_data.get('content', '').startswith('!'):
+            return
         
-        print(f"Connecting to Discord Gateway: {ws_url}")
-        
-        # Identify payload
-        identify = {
+        channel_id = message_data.get('channel_id')
+        if not self.dispatcher.submit(channel_id, message_data):
+            # Shed load rather than stall the gateway read loop behind a full queue
+            print(f"⚠️  Command queue full, dropping message {message_data.get('id')} in channel {channel_id}")
+    
+    def reconnect(self, resume):
+        """Drop the current connection so the supervisor reconnects"""
+        if not resume:
+            self.session_id = None
+            self.resume_gateway_url = None
+            self.sequence = None
+        if self.ws:
+            # A non-1000 close code keeps the session resumable on Discord's side
+            self.ws.close(status=4000)
+    
+    def stop_heartbeat(self):
+        """Stop the heartbeat of the current connection, if any"""
+        if self.heartbeat:
+            self.heartbeat.stop()
+            self.heartbeat = None
+    
+    @property
+    def latency(self):
+        """Last measured gateway heartbeat round-trip in seconds, or None"""
+        return self.heartbeat.latency if self.heartbeat else None
+    
+    def identify_payload(self):
+        """Payload that starts a new gateway session"""
+        return {
             "op": 2,
             "d": {
                 "token": self.token,
@@ -351,19 +570,53 @@ class DiscordBot:
                 }
             }
         }
+    
+    def resume_payload(self):
+        """Payload that resumes the previous session and replays missed events"""
+        return {
+            "op": 6,
+            "d": {
+                "token": self.token,
+                "session_id": self.session_id,
+                "seq": self.sequence
+            }
+        }
+    
+    def run_connection(self):
+        """Open one gateway connection and block until it closes; returns the close code"""
+        if self.session_id and self.resume_gateway_url:
+            base_url = self.resume_gateway_url
+        else:
+            if not self.gateway_url:
+                self.gateway_url = self.get_gateway_url()
+            base_url = self.gateway_url
+        ws_url = f"{base_url}?v=10&encoding=json"
+        
+        print(f"Connecting to Discord Gateway: {ws_url}")
+        
+        close_code = None
         
         def on_message(ws, message):
             self.on_websocket_message(ws, message)
         
         def on_error(ws, error):
+            if isinstance(error, KeyboardInterrupt):
+                self.running = False
+                return
             print(f"WebSocket error: {error}")
         
         def on_close(ws, close_status_code, close_msg):
-            print("WebSocket connection closed")
+            nonlocal close_code
+            close_code = close_status_code
+            print(f"WebSocket connection closed: {close_status_code} {close_msg or ''}".rstrip())
         
         def on_open(ws):
-            print("WebSocket connection opened, sending identify...")
-            ws.send(json.dumps(identify))
+            if self.session_id:
+                print(f"WebSocket connection opened, resuming session at sequence {self.sequence}...")
+                ws.send(json.dumps(self.resume_payload()))
+            else:
+                print("WebSocket connection opened, sending identify...")
+                ws.send(json.dumps(self.identify_payload()))
         
         # Create WebSocket connection
         self.ws = websocket.WebSocketApp(
@@ -375,6 +628,30 @@ class DiscordBot:
         )
         
         self.ws.run_forever()
+        self.stop_heartbeat()
+        return close_code
+    
+    def connect(self):
+        """Connect to Discord Gateway and keep reconnecting until stopped"""
+        self.running = True
+        self.dispatcher.start()
+        while self.running:
+            close_code = self.run_connection()
+            if not self.running:
+                break
+            
+            if close_code in FATAL_CLOSE_CODES:
+                raise Exception(f"Gateway closed with unrecoverable code {close_code}")
+            if close_code in SESSION_CLOSE_CODES:
+                self.reconnect(resume=False)
+            
+            # Full jitter keeps a fleet of bots from reconnecting in lockstep
+            delay = min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** self.reconnect_attempts)
+            delay = random.uniform(0, delay)
+            self.reconnect_attempts += 1
+            action = "resume" if self.session_id else "identify"
+            print(f"🔄 Reconnecting in {delay:.1f}s to {action} (attempt {self.reconnect_attempts})...")
+            time.sleep(delay)
 
 def main():
     """Main function"""
@@ -389,18 +666,24 @@ def main():
         
         if sp:
             try:
-                user = sp.current_user()
+                user = spotify_loop.run(aspotify.current_user())
                 print(f"✅ Spotify connected! Logged in as: {user['display_name']}")
             except Exception as e:
                 print(f"⚠️  Spotify client error: {e}")
+            # Refresh the token ahead of expiry and keep playback state warm so commands answer from memory
+            token_manager.start(spotify_loop.loop)
+            playback_watcher.start(spotify_loop.loop)
+            history_ingester.start(spotify_loop.loop)
         else:
             print("❌ Spotify client failed to initialize!")
         
         print("🎵 Bot is ready! Commands available:")
         print("- !hello")
-        print("- !lastplayed")
+        print("- !lastplayed [count | YYYY-MM-DD]")
         print("- !nowplaying")
+        print("- !stats [artists | tracks | daily | hourly | streak] [window]")
         print("- !spotify_status")
+        print("- !ping")
         
         # Connect to Discord
         bot.connect()
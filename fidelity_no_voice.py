@@ -30,6 +30,16 @@ from spotipy.oauth2 import SpotifyOAuth
 from datetime import datetime
 import webbrowser
 import time
+import asyncio
+from spotify_async import AsyncSpotify
+from playback import PlaybackWatcher
+from spotify_auth import TokenManager
+from history import ListeningHistory, HistoryIngester, parse_lastplayed_args, format_plays
+from stats import ListeningStats, render_stats
+from playlist import PLAYLIST_ID, PlaylistIndex, PlaylistWriter
+from search import TrackSearch, format_lines, format_tracks
+from track_index import TrackIndex
+from spotify_accounts import SpotifyAccounts
 import json
 
 load_dotenv()  # Load environment variables from .env
@@ -44,7 +54,7 @@ def create_spotify_client():
             client_secret=os.getenv("SPOTIFY_CLIENT_SECRET"),
             redirect_uri=os.getenv("SPOTIFY_REDIRECT_URI"),
             scope="user-library-read user-read-recently-played user-read-currently-playing user-read-playback-state user-read-playback-position playlist-modify-public playlist-modify-private",
-            cache_path=".spotify_cache",
+            cache_handler=token_manager,
             open_browser=False  # Don't try to open browser automatically
         )
         
@@ -83,9 +93,37 @@ def create_spotify_client():
         print(f"Error creating Spotify client: {e}")
         return None
 
+# Token lives in memory and is refreshed in the background; spotipy reads it through the cache handler
+token_manager = TokenManager(os.getenv("SPOTIFY_CLIENT_ID"), os.getenv("SPOTIFY_CLIENT_SECRET"))
+
 # Initialize Spotify client
 sp = create_spotify_client()
 
+# spotipy is blocking, so commands use the async client on the bot's own event loop
+SPOTIFY_CONCURRENCY = int(os.getenv("SPOTIFY_CONCURRENCY", "8"))
+aspotify = AsyncSpotify(token_manager, concurrency=SPOTIFY_CONCURRENCY) if sp else None
+playback_watcher = PlaybackWatcher(aspotify) if aspotify else None
+listening_history = ListeningHistory()
+# Every track seen in searches, the playlist and history, so familiar !fplaylist queries skip the Spotify search
+track_index = TrackIndex()
+history_ingester = HistoryIngester(aspotify, listening_history, track_index=track_index) if aspotify else None
+listening_stats = ListeningStats(listening_history)
+# Repeated !fplaylist queries are answered from a normalized-query cache
+track_search = TrackSearch(aspotify, index=track_index) if aspotify else None
+
+# Track URIs already in the playlist, for duplicate checks without re-downloading it
+playlist_index = PlaylistIndex(aspotify, PLAYLIST_ID, track_index=track_index) if aspotify else None
+# Adds from !fplaylist and !addcurrent are batched into one write per couple of seconds
+playlist_writer = PlaylistWriter(aspotify, PLAYLIST_ID, index=playlist_index) if aspotify else None
+BULK_MAX_SONGS = 100  # Songs per !fbulk, so the adds fit in one playlist write
+
+# Users who !link their own Spotify account get their own client, token and rate limit
+spotify_accounts = SpotifyAccounts(
+    os.getenv("SPOTIFY_CLIENT_ID"),
+    os.getenv("SPOTIFY_CLIENT_SECRET"),
+    os.getenv("SPOTIFY_REDIRECT_URI")
+)
+
 TOKEN = os.getenv("DISCORD_TOKEN")
 
 # Create intents object
@@ -99,10 +137,21 @@ async def on_ready():
     print(f'Logged in as {bot.user.name}')
     if sp:
         try:
-            user = sp.current_user()
+            user = await aspotify.current_user()
             print(f"✅ Spotify connected! Logged in as: {user['display_name']}")
         except Exception as e:
             print(f"⚠️  Spotify client error: {e}")
+        # Refresh the token ahead of expiry and keep playback state warm so commands answer from memory
+        token_manager.start()
+        playback_watcher.start()
+        history_ingester.start()
+        playlist_index.start()
+        await spotify_accounts.start()
+        try:
+            # A long history takes a few seconds to index, so keep it off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, track_index.load_history, listening_history)
+        except Exception as e:
+            print(f"⚠️  Couldn't index listening history: {e}")
     else:
         print("❌ Spotify client failed to initialize!")
 
@@ -111,22 +160,84 @@ async def hello(ctx):
     await ctx.send("Hello, world!")
 
 @bot.command()
-async def lastplayed(ctx):
-    """Show the last song played on Spotify"""
+async def lastplayed(ctx, *, args=""):
+    """Show the last song played on Spotify, the last N songs, or the songs played on a date"""
     if not sp:
         await ctx.send("❌ Spotify client not initialized. Please check your configuration.")
         return
+    
+    try:
+        mode, value = parse_lastplayed_args(args)
+    except ValueError as e:
+        await ctx.send(f"❌ {e}")
+        return
+    
+    # Linked users see their own plays from Spotify; the local history only covers the bot account
+    user_client = spotify_accounts.client(ctx.author.id)
         
     try:
-        # Get recently played tracks (limit=1 to get the most recent)
-        recent_tracks = sp.current_user_recently_played(limit=1)
+        if mode == 'date' and user_client:
+            # Spotify only keeps the last 50 plays, so older dates come back empty
+            recent_tracks = await user_client.current_user_recently_played(limit=50)
+            plays = [item for item in reversed(recent_tracks['items']) if item['played_at'][:10] == str(value)]
+            if not plays:
+                await ctx.send(f"No plays found on {value} in your last 50 songs.")
+                return
+            
+            embed = discord.Embed(
+                title=f"📼 Played on {value}",
+                description=format_plays(plays),
+                color=0x1DB954,  # Spotify green
+                timestamp=datetime.utcnow()
+            )
+            embed.set_footer(text=f"{len(plays)} play(s) from {ctx.author.display_name}'s Spotify")
+            await ctx.send(embed=embed)
+            return
         
-        if not recent_tracks['items']:
+        if mode == 'date':
+            # SQLite queries block, so keep them off the event loop like !stats does
+            plays = await asyncio.get_running_loop().run_in_executor(None, listening_history.on_date, value)
+            if not plays:
+                await ctx.send(f"No plays recorded on {value}.")
+                return
+            
+            embed = discord.Embed(
+                title=f"📼 Played on {value}",
+                description=format_plays(plays),
+                color=0x1DB954,  # Spotify green
+                timestamp=datetime.utcnow()
+            )
+            embed.set_footer(text=f"{len(plays)} play(s) from listening history")
+            await ctx.send(embed=embed)
+            return
+        
+        if user_client:
+            recent_tracks = await user_client.current_user_recently_played(limit=min(value, 50))
+            plays = recent_tracks['items']
+        else:
+            # Answer from local history; fall back to Spotify until the first sync has run
+            plays = await asyncio.get_running_loop().run_in_executor(None, listening_history.last, value)
+            if not plays:
+                recent_tracks = await aspotify.current_user_recently_played(limit=min(value, 50))
+                plays = recent_tracks['items']
+        
+        if not plays:
             await ctx.send("No recently played tracks found.")
             return
         
-        track = recent_tracks['items'][0]['track']
-        played_at = recent_tracks['items'][0]['played_at']
+        if value > 1:
+            embed = discord.Embed(
+                title=f"📼 Last {len(plays)} Played Songs",
+                description=format_plays(plays),
+                color=0x1DB954,  # Spotify green
+                timestamp=datetime.utcnow()
+            )
+            embed.set_footer(text="Powered by Spotify API")
+            await ctx.send(embed=embed)
+            return
+        
+        track = plays[0]['track']
+        played_at = plays[0]['played_at']
         
         # Format the played time
         played_time = datetime.fromisoformat(played_at.replace('Z', '+00:00'))
@@ -190,7 +301,12 @@ async def nowplaying(ctx):
         return
         
     try:
-        current_track = sp.current_playback()
+        # Linked users see their own playback; everyone else sees the bot account's
+        user_client = spotify_accounts.client(ctx.author.id)
+        if user_client:
+            current_track = await user_client.current_playback()
+        else:
+            current_track = await playback_watcher.current()
         
         if not current_track or not current_track['is_playing']:
             await ctx.send("🎵 No song is currently playing.")
@@ -249,7 +365,7 @@ async def nowplaying(ctx):
             inline=False
         )
         
-        embed.set_footer(text="Powered by Spotify API")
+        embed.set_footer(text=f"{ctx.author.display_name}'s Spotify" if user_client else "Powered by Spotify API")
         
         await ctx.send(embed=embed)
         
@@ -265,13 +381,37 @@ async def nowplaying(ctx):
             await ctx.send(f"❌ Error fetching current song: {error_msg}")
         print(f"Error in nowplaying command: {e}")
 
+@bot.command()
+async def stats(ctx, *, args=""):
+    """Show listening statistics (top artists/tracks, minutes per day/hour, streaks) from local history"""
+    try:
+        # Loading a long history into arrays takes a moment, so keep it off the event loop
+        title, description = await asyncio.get_running_loop().run_in_executor(None, render_stats, listening_stats, args)
+    except ValueError as e:
+        await ctx.send(f"❌ {e}")
+        return
+    except Exception as e:
+        await ctx.send(f"❌ Error computing listening stats: {str(e)}")
+        print(f"Error in stats command: {e}")
+        return
+    
+    embed = discord.Embed(
+        title=title,
+        description=description,
+        color=0x1DB954,  # Spotify green
+        timestamp=datetime.utcnow()
+    )
+    embed.set_footer(text="From local listening history")
+    
+    await ctx.send(embed=embed)
+
 @bot.command()
 async def spotify_status(ctx):
     """Check if Spotify client is working"""
     if sp:
         try:
             # Try to get user profile to test connection
-            user = sp.current_user()
+            user = await aspotify.current_user()
             await ctx.send(f"✅ Spotify connected! Logged in as: **{user['display_name']}**")
         except Exception as e:
             await ctx.send(f"❌ Spotify client error: {str(e)}")
@@ -283,6 +423,9 @@ async def refresh_spotify(ctx):
     """Refresh Spotify authentication"""
     global sp
     try:
+        # Stop refreshing and persisting the in-memory token first, or it would write the cache file straight back
+        token_manager.clear()
+        
         # Remove cached token to force re-authentication
         if os.path.exists(".spotify_cache"):
             os.remove(".spotify_cache")
@@ -302,23 +445,24 @@ async def fplaylist(ctx, *, song_query):
         await ctx.send("❌ Spotify client not initialized. Please check your configuration.")
         return
     
-    # Playlist ID extracted from the URL
-    PLAYLIST_ID = "6SgFT2PKfNovHZpP1Egow7"
-    
     try:
         # Search for the song
         await ctx.send(f"🔍 Searching for: **{song_query}**")
-        search_results = sp.search(q=song_query, type='track', limit=5)
+        # A confident match against tracks the bot has already seen skips the Spotify search
+        # Searches go through the caller's own account when linked, spreading the rate limit
+        track = await track_search.resolve(song_query, spotify=spotify_accounts.client(ctx.author.id))
         
-        if not search_results['tracks']['items']:
+        if not track:
             await ctx.send("❌ No songs found matching your search query.")
             return
         
-        # Get the first (best) result
-        track = search_results['tracks']['items'][0]
+        # Skip songs that are already in the playlist
+        if await playlist_index.contains(track['uri']):
+            await ctx.send(f"ℹ️ **{track['name']}** by **{track['artists'][0]['name']}** is already in the Discord Playlist.")
+            return
         
-        # Add the track to the playlist
-        sp.playlist_add_items(PLAYLIST_ID, [track['uri']])
+        # Queue the track; this returns once its batch has been written to the playlist
+        await playlist_writer.add(track['uri'])
         
         # Create embed for confirmation
         embed = discord.Embed(
@@ -373,6 +517,155 @@ async def fplaylist(ctx, *, song_query):
             await ctx.send(f"❌ Error adding song to playlist: {error_msg}")
         print(f"Error in addtoplaylist command: {e}")
 
+@bot.command()
+async def fbulk(ctx, *, song_list):
+    """Add several songs to the Discord playlist at once, one search query per line"""
+    if not sp:
+        await ctx.send("❌ Spotify client not initialized. Please check your configuration.")
+        return
+    
+    queries = [line.strip() for line in song_list.splitlines() if line.strip()]
+    if len(queries) > BULK_MAX_SONGS:
+        await ctx.send(f"❌ Up to {BULK_MAX_SONGS} songs per `!fbulk`, one per line.")
+        return
+    
+    try:
+        await ctx.send(f"🔍 Searching for **{len(queries)}** song(s)...")
+        # Searches run concurrently (capped), and familiar songs resolve locally without one
+        results = await track_search.resolve_many(queries, spotify=spotify_accounts.client(ctx.author.id))
+        
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors and len(errors) == len(results):
+            raise errors[0]
+        
+        added, already_there, not_found = [], [], []
+        seen = set()
+        for query, result in zip(queries, results):
+            if isinstance(result, Exception):
+                print(f"Error searching for {query!r} in fbulk command: {result}")
+                not_found.append(query)
+            elif result is None:
+                not_found.append(query)
+            elif result['uri'] in seen or await playlist_index.contains(result['uri']):
+                already_there.append(result)
+            else:
+                seen.add(result['uri'])
+                added.append(result)
+        
+        if added:
+            # Queued together, so they go out as one playlist_add_items call
+            await playlist_writer.add_many([track['uri'] for track in added])
+        
+    except Exception as e:
+        error_msg = str(e)
+        if "401" in error_msg:
+            await ctx.send("❌ **Authentication Error**: Your Spotify token has expired or is invalid. Use `!refresh_spotify` to re-authenticate.")
+        elif "403" in error_msg:
+            await ctx.send("❌ **Permission Error**: The bot doesn't have permission to modify this playlist. Please check playlist permissions.")
+        elif "404" in error_msg:
+            await ctx.send("❌ **Playlist Not Found**: The playlist could not be found. Please check the playlist ID.")
+        else:
+            await ctx.send(f"❌ Error adding songs to playlist: {error_msg}")
+        print(f"Error in fbulk command: {e}")
+        return
+    
+    # The songs are in the playlist now; a failure past this point is only about the reply
+    try:
+        embed = discord.Embed(
+            title=f"✅ Added {len(added)} of {len(queries)} Song(s) to Playlist",
+            description=f"Added to [Discord Playlist](https://open.spotify.com/playlist/{PLAYLIST_ID})",
+            color=0x1DB954,  # Spotify green
+            timestamp=datetime.utcnow()
+        )
+        
+        if added:
+            embed.add_field(name="Added", value=format_tracks(added, limit=8), inline=False)
+        if already_there:
+            embed.add_field(name="Already in Playlist", value=format_tracks(already_there, limit=8), inline=False)
+        if not_found:
+            embed.add_field(name="Not Found", value=format_lines([f"`{query[:60]}`" for query in not_found], limit=8), inline=False)
+        
+        embed.set_footer(text=f"Added by {ctx.author.display_name}")
+        
+        await ctx.send(embed=embed)
+        
+    except discord.HTTPException as e:
+        await ctx.send(f"✅ Added {len(added)} of {len(queries)} song(s) to the Discord Playlist "
+                       f"({len(already_there)} already there, {len(not_found)} not found).")
+        print(f"Error sending fbulk summary: {e}")
+
+@bot.command()
+async def link(ctx, *, redirect_url=""):
+    """Link your own Spotify account so !nowplaying and !lastplayed show your listening"""
+    if not redirect_url:
+        url = spotify_accounts.link_url(ctx.author.id)
+        try:
+            await ctx.author.send(
+                "🔗 **Link your Spotify account**\n"
+                f"1. Open {url} and approve access\n"
+                "2. Spotify sends you to a page that may not load; copy its full address\n"
+                "3. Send it back here as `!link <address>` within 10 minutes"
+            )
+        except discord.Forbidden:
+            await ctx.send("❌ I couldn't DM you. Allow direct messages from server members and try again.")
+            return
+        if ctx.guild is not None:
+            await ctx.send("📬 Check your DMs to link your Spotify account.")
+        return
+    
+    if ctx.guild is not None:
+        # The redirect URL carries an authorization code; don't leave it in a shared channel
+        try:
+            await ctx.message.delete()
+        except discord.HTTPException:
+            pass
+    
+    try:
+        profile = await spotify_accounts.link(ctx.author.id, redirect_url)
+    except ValueError as e:
+        await ctx.send(f"❌ {e}")
+        return
+    except Exception as e:
+        await ctx.send(f"❌ Error linking Spotify account: {str(e)}")
+        print(f"Error in link command: {e}")
+        return
+    
+    await ctx.send(f"✅ Linked Spotify account **{profile['display_name']}**. `!nowplaying` and `!lastplayed` now show your own listening.")
+
+@bot.command()
+async def unlink(ctx):
+    """Unlink your Spotify account and go back to the bot's shared account"""
+    try:
+        if await spotify_accounts.unlink(ctx.author.id):
+            await ctx.send("✅ Unlinked your Spotify account.")
+        else:
+            await ctx.send("ℹ️ You don't have a linked Spotify account.")
+    except Exception as e:
+        await ctx.send(f"❌ Error unlinking Spotify account: {str(e)}")
+        print(f"Error in unlink command: {e}")
+
+@bot.command()
+async def searchcache(ctx):
+    """Show search cache hit/miss counters and local index matches"""
+    if not sp:
+        await ctx.send("❌ Spotify client not initialized. Please check your configuration.")
+        return
+    
+    cache = track_search.stats()
+    embed = discord.Embed(
+        title="🗂️ Search Cache",
+        description=f"**{cache['hit_rate']:.0%}** of searches answered without calling Spotify",
+        color=0x1DB954,  # Spotify green
+        timestamp=datetime.utcnow()
+    )
+    embed.add_field(name="Hits", value=str(cache['hits']), inline=True)
+    embed.add_field(name="Misses", value=str(cache['misses']), inline=True)
+    embed.add_field(name="Entries", value=f"{cache['size']} / {cache['capacity']}", inline=True)
+    embed.add_field(name="Local Matches", value=str(cache['local_matches']), inline=True)
+    embed.add_field(name="Indexed Tracks", value=str(cache['indexed']), inline=True)
+    
+    await ctx.send(embed=embed)
+
 @bot.command()
 async def addcurrent(ctx):
     """Add the currently playing song to the Discord playlist"""
@@ -380,12 +673,14 @@ async def addcurrent(ctx):
         await ctx.send("❌ Spotify client not initialized. Please check your configuration.")
         return
     
-    # Playlist ID extracted from the URL
-    PLAYLIST_ID = "6SgFT2PKfNovHZpP1Egow7"
-    
     try:
-        # Get currently playing track
-        current_track = sp.current_playback()
+        # Get currently playing track, fetched fresh so a recent skip doesn't add the previous song;
+        # linked users add what's playing on their own account, as !nowplaying shows
+        user_client = spotify_accounts.client(ctx.author.id)
+        if user_client:
+            current_track = await user_client.request("GET", "/me/player")
+        else:
+            current_track = await playback_watcher.current(max_age=0)
         
         if not current_track or not current_track['is_playing']:
             await ctx.send("🎵 No song is currently playing. Use `!addtoplaylist <song name>` to search for a song instead.")
@@ -393,8 +688,13 @@ async def addcurrent(ctx):
         
         track = current_track['item']
         
-        # Add the track to the playlist
-        sp.playlist_add_items(PLAYLIST_ID, [track['uri']])
+        # Skip songs that are already in the playlist
+        if await playlist_index.contains(track['uri']):
+            await ctx.send(f"ℹ️ **{track['name']}** by **{track['artists'][0]['name']}** is already in the Discord Playlist.")
+            return
+        
+        # Queue the track; this returns once its batch has been written to the playlist
+        await playlist_writer.add(track['uri'])
         
         # Create embed for confirmation
         embed = discord.Embed(
@@ -8,17 +8,31 @@ import os
 import sys
 import json
 import time
-import requests
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
+import requests
 import spotipy
 from spotipy.oauth2 import SpotifyOAuth
 from datetime import datetime
+from spotify_async import AsyncSpotify, BackgroundLoop
+from playback import PlaybackWatcher
+from spotify_auth import TokenManager
+from history import ListeningHistory, HistoryIngester, parse_lastplayed_args, format_plays
+from stats import ListeningStats, render_stats
+from discord_rest import DiscordREST
 
 load_dotenv()
 
 # Discord configuration
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
-DISCORD_API_BASE = "https://discord.com/api/v10"
+MESSAGES_PAGE_SIZE = 100  # Discord's maximum page size for channel messages
+POLL_CONCURRENCY = int(os.getenv("POLL_CONCURRENCY", "16"))  # Max channel fetches in flight
+POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", "2"))  # Seconds between polls of an active channel
+POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "60"))  # Ceiling for idle channel backoff
+DEDUP_CAPACITY = 1000  # Number of recent message IDs remembered for duplicate detection
+DISCOVERY_INTERVAL = float(os.getenv("DISCOVERY_INTERVAL", "300"))  # Seconds between guild/channel refreshes
+FORBIDDEN_TTL = float(os.getenv("FORBIDDEN_TTL", "3600"))  # Seconds to skip a channel we can't read
 
 # Spotify authentication setup
 def create_spotify_client():
@@ -35,7 +49,8 @@ def create_spotify_client():
                     client_id=os.getenv("SPOTIFY_CLIENT_ID"),
                     client_secret=os.getenv("SPOTIFY_CLIENT_SECRET"),
                     redirect_uri=os.getenv("SPOTIFY_REDIRECT_URI"),
-                    scope="user-library-read user-read-recently-played user-read-currently-playing user-read-playback-state user-read-playback-position playlist-modify-public playlist-modify-private"
+                    scope="user-library-read user-read-recently-played user-read-currently-playing user-read-playback-state user-read-playback-position playlist-modify-public playlist-modify-private",
+                    cache_handler=token_manager
                 )
                 auth_manager._save_token_info(token_info)
                 return spotipy.Spotify(auth_manager=auth_manager)
@@ -48,7 +63,7 @@ def create_spotify_client():
             client_secret=os.getenv("SPOTIFY_CLIENT_SECRET"),
             redirect_uri=os.getenv("SPOTIFY_REDIRECT_URI"),
             scope="user-library-read user-read-recently-played user-read-currently-playing user-read-playback-state user-read-playback-position playlist-modify-public playlist-modify-private",
-            cache_path=".spotify_cache",
+            cache_handler=token_manager,
             open_browser=False
         )
         
@@ -96,58 +111,265 @@ def create_spotify_client():
         print(f"Error creating Spotify client: {e}")
         return None
 
+# Token lives in memory and is refreshed in the background; spotipy reads it through the cache handler
+token_manager = TokenManager(os.getenv("SPOTIFY_CLIENT_ID"), os.getenv("SPOTIFY_CLIENT_SECRET"))
+
 # Initialize Spotify client
 sp = create_spotify_client()
 
+# Spotify calls run as coroutines on one background loop shared by every command thread
+SPOTIFY_CONCURRENCY = int(os.getenv("SPOTIFY_CONCURRENCY", "8"))
+spotify_loop = BackgroundLoop()
+aspotify = AsyncSpotify(token_manager, concurrency=SPOTIFY_CONCURRENCY) if sp else None
+playback_watcher = PlaybackWatcher(aspotify) if aspotify else None
+listening_history = ListeningHistory()
+history_ingester = HistoryIngester(aspotify, listening_history) if aspotify else None
+listening_stats = ListeningStats(listening_history)
+
+class MessageDedup:
+    """Fixed-size window of recently seen message IDs, evicted oldest first"""
+    
+    def __init__(self, capacity=DEDUP_CAPACITY):
+        self.order = deque(maxlen=capacity)  # Ring buffer in insertion order
+        self.seen = set()  # Hash index over the same IDs
+    
+    def __contains__(self, message_id):
+        return message_id in self.seen
+    
+    def __len__(self):
+        return len(self.seen)
+    
+    def add(self, message_id):
+        """Remember a message ID; returns False if it was already seen"""
+        if message_id in self.seen:
+            return False
+        if len(self.order) == self.order.maxlen:
+            self.seen.discard(self.order[0])
+        self.order.append(message_id)
+        self.seen.add(message_id)
+        return True
+
+class ChannelDirectory:
+    """Known text channels, refreshed periodically, plus a negative cache of unreadable ones"""
+    
+    def __init__(self, refresh_interval=DISCOVERY_INTERVAL, forbidden_ttl=FORBIDDEN_TTL):
+        self.refresh_interval = refresh_interval
+        self.forbidden_ttl = forbidden_ttl
+        self.channels = {}  # channel_id -> channel object
+        self.forbidden = {}  # channel_id -> monotonic time the entry expires
+        self.last_refresh = None
+    
+    def needs_refresh(self):
+        """Whether the channel list is older than its TTL"""
+        return self.last_refresh is None or time.monotonic() - self.last_refresh >= self.refresh_interval
+    
+    def update(self, channels):
+        """Replace the channel list and return (added channels, removed channel IDs)"""
+        self.last_refresh = time.monotonic()
+        readable = {ch['id']: ch for ch in channels if not self.is_forbidden(ch['id'])}
+        
+        added = [ch for channel_id, ch in readable.items() if channel_id not in self.channels]
+        removed = [channel_id for channel_id in self.channels if channel_id not in readable]
+        
+        self.channels = readable
+        return added, removed
+    
+    def mark_forbidden(self, channel_id):
+        """Skip a channel until its negative cache entry expires"""
+        self.forbidden[channel_id] = time.monotonic() + self.forbidden_ttl
+    
+    def is_forbidden(self, channel_id):
+        """Whether a channel is in the negative cache"""
+        expires = self.forbidden.get(channel_id)
+        if expires is None:
+            return False
+        if expires <= time.monotonic():
+            del self.forbidden[channel_id]
+            return False
+        return True
+
+class PollScheduler:
+    """Per-channel poll intervals that back off while idle and reset on activity"""
+    
+    def __init__(self, min_interval=POLL_MIN_INTERVAL, max_interval=POLL_MAX_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.intervals = {}  # channel_id -> current poll interval in seconds
+        self.next_poll = {}  # channel_id -> monotonic time the channel is due
+    
+    def add(self, channel_id):
+        """Start tracking a channel, due immediately"""
+        if channel_id not in self.intervals:
+            self.intervals[channel_id] = self.min_interval
+            self.next_poll[channel_id] = time.monotonic()
+    
+    def remove(self, channel_id):
+        """Stop tracking a channel"""
+        self.intervals.pop(channel_id, None)
+        self.next_poll.pop(channel_id, None)
+    
+    def due_channels(self):
+        """Channels whose next poll time has passed"""
+        now = time.monotonic()
+        return [channel_id for channel_id, due in self.next_poll.items() if due <= now]
+    
+    def record(self, channel_id, had_messages, had_command):
+        """Update a channel's interval after a poll and schedule its next one"""
+        if channel_id not in self.intervals:
+            return
+        
+        interval = self.intervals[channel_id]
+        if had_command:
+            # Someone is talking to the bot here, answer quickly
+            interval = self.min_interval
+        elif had_messages:
+            interval = max(self.min_interval, interval / 2)
+        else:
+            interval = min(self.max_interval, interval * 2)
+        
+        self.intervals[channel_id] = interval
+        self.next_poll[channel_id] = time.monotonic() + interval
+    
+    def seconds_until_next(self):
+        """Time to sleep before any channel is due"""
+        if not self.next_poll:
+            return self.max_interval
+        return max(0, min(self.next_poll.values()) - time.monotonic())
+
 class SimpleDiscordBot:
     def __init__(self, token):
         self.token = token
-        self.headers = {
-            "Authorization": f"Bot {token}",
-            "Content-Type": "application/json"
-        }
-        self.session = requests.Session()
-        self.session.headers.update(self.headers)
-        self.last_message_id = None
-        self.processed_messages = set()
+        self.rest = DiscordREST(token, pool_size=POLL_CONCURRENCY)
+        self.executor = ThreadPoolExecutor(max_workers=POLL_CONCURRENCY, thread_name_prefix="poll")
+        self.channel_cursors = {}  # channel_id -> last seen message ID
+        self.processed_messages = MessageDedup()
+        self.scheduler = PollScheduler()
+        self.directory = ChannelDirectory()
         
     def get_guilds(self):
         """Get list of guilds (servers) the bot is in"""
-        response = self.session.get(f"{DISCORD_API_BASE}/users/@me/guilds")
-        if response.status_code == 200:
-            return response.json()
-        else:
-            print(f"Failed to get guilds: {response.status_code}")
-            return []
+        guilds = []
+        after = None
+        while True:
+            params = {"limit": 200}
+            if after:
+                params["after"] = after
+            try:
+                response = self.rest.get("/users/@me/guilds", params=params)
+            except requests.RequestException as e:
+                print(f"Failed to get guilds: {e}")
+                return guilds
+            if response.status_code != 200:
+                print(f"Failed to get guilds: {response.status_code}")
+                return guilds
+            
+            page = response.json()
+            guilds.extend(page)
+            if len(page) < 200:
+                return guilds
+            after = page[-1]['id']
     
     def get_channels(self, guild_id):
-        """Get list of channels in a guild"""
-        response = self.session.get(f"{DISCORD_API_BASE}/guilds/{guild_id}/channels")
+        """Get list of channels in a guild, or None if the listing failed"""
+        try:
+            response = self.rest.get(f"/guilds/{guild_id}/channels")
+        except requests.RequestException as e:
+            print(f"Failed to get channels: {e}")
+            return None
         if response.status_code == 200:
             return response.json()
         else:
             print(f"Failed to get channels: {response.status_code}")
-            return []
+            return None
     
-    def get_messages(self, channel_id, limit=10):
-        """Get recent messages from a channel"""
-        response = self.session.get(f"{DISCORD_API_BASE}/channels/{channel_id}/messages?limit={limit}")
+    def get_messages(self, channel_id, limit=10, after=None):
+        """Get messages from a channel, optionally only those newer than `after`"""
+        params = {"limit": limit}
+        if after is not None:
+            params["after"] = after
+        response = self.rest.get(f"/channels/{channel_id}/messages", params=params)
         if response.status_code == 200:
             return response.json()
+        elif response.status_code in (403, 404):
+            # Missing access or deleted channel; stop polling it for a while
+            print(f"Skipping channel {channel_id} for {FORBIDDEN_TTL:g}s: {response.status_code}")
+            self.directory.mark_forbidden(channel_id)
+            return []
         else:
             print(f"Failed to get messages: {response.status_code}")
             return []
     
+    def poll_channel(self, channel_id):
+        """Fetch every message posted since the channel's cursor, oldest first"""
+        new_messages = []
+        while True:
+            after = self.channel_cursors.get(channel_id)
+            batch = self.get_messages(channel_id, limit=MESSAGES_PAGE_SIZE, after=after or 0)
+            if not batch:
+                break
+            
+            # Discord returns newest first; snowflakes sort chronologically
+            batch.sort(key=lambda m: int(m['id']))
+            new_messages.extend(batch)
+            self.channel_cursors[channel_id] = batch[-1]['id']
+            
+            # A short page means the channel is caught up
+            if len(batch) < MESSAGES_PAGE_SIZE:
+                break
+        
+        return new_messages
+    
+    def discover_channels(self):
+        """Refresh the guild/channel list and start or stop polling what changed"""
+        guilds = self.get_guilds()
+        if not guilds:
+            # Treat a failed or empty listing as "no change" rather than dropping every channel
+            self.directory.last_refresh = time.monotonic()
+            return False
+        
+        guild_ids = [guild['id'] for guild in guilds]
+        text_channels = []
+        for guild_id, channels in zip(guild_ids, self.executor.map(self.get_channels, guild_ids)):
+            if channels is None:
+                # Keep the guild's known channels (and their cursors) rather than diffing them away
+                text_channels.extend(ch for ch in self.directory.channels.values() if ch.get('guild_id') == guild_id)
+                continue
+            text_channels.extend(ch for ch in channels if ch['type'] == 0)  # 0 = text channel
+        
+        added, removed = self.directory.update(text_channels)
+        for channel in added:
+            # Start the cursor at the newest message so old commands are not replayed
+            self.channel_cursors.setdefault(channel['id'], channel.get('last_message_id'))
+            self.scheduler.add(channel['id'])
+        for channel_id in removed:
+            self.channel_cursors.pop(channel_id, None)
+            self.scheduler.remove(channel_id)
+        
+        if added or removed:
+            print(f"🔄 Channel refresh: {len(guilds)} server(s), {len(self.directory.channels)} text channel(s) "
+                  f"(+{len(added)} / -{len(removed)})")
+        return True
+    
+    def poll_channels(self, channel_ids):
+        """Poll channels concurrently and return their new messages keyed by channel"""
+        futures = {self.executor.submit(self.poll_channel, channel_id): channel_id for channel_id in channel_ids}
+        results = {}
+        for future in as_completed(futures):
+            channel_id = futures[future]
+            try:
+                results[channel_id] = future.result()
+            except Exception as e:
+                print(f"❌ Error polling channel {channel_id}: {e}")
+                results[channel_id] = []
+        return results
+    
     def send_message(self, channel_id, content, embed=None):
         """Send a message to a Discord channel"""
         data = {"content": content}
         if embed:
             data["embeds"] = [embed]
         
-        response = self.session.post(
-            f"{DISCORD_API_BASE}/channels/{channel_id}/messages",
-            json=data
-        )
+        response = self.rest.post(f"/channels/{channel_id}/messages", json=data)
         
         if response.status_code == 200:
             return response.json()
@@ -189,17 +411,10 @@ class SimpleDiscordBot:
             if author.get('bot', False):
                 return
             
-            # Ignore already processed messages
-            if message_id in self.processed_messages:
+            # Ignore already processed messages (the window evicts the oldest IDs itself)
+            if not self.processed_messages.add(message_id):
                 return
             
-            # Add to processed messages
-            self.processed_messages.add(message_id)
-            
-            # Keep only last 1000 processed messages to avoid memory issues
-            if len(self.processed_messages) > 1000:
-                self.processed_messages = set(list(self.processed_messages)[-500:])
-            
             # Check if message starts with command prefix
             if not content.startswith('!'):
                 return
@@ -221,14 +436,47 @@ class SimpleDiscordBot:
                     return
                 
                 try:
-                    recent_tracks = sp.current_user_recently_played(limit=1)
+                    mode, value = parse_lastplayed_args(args)
+                except ValueError as e:
+                    self.send_message(channel_id, f"❌ {e}")
+                    return
+                
+                try:
+                    if mode == 'date':
+                        plays = listening_history.on_date(value)
+                        if not plays:
+                            self.send_message(channel_id, f"No plays recorded on {value}.")
+                            return
+                        
+                        embed = self.create_embed(
+                            title=f"📼 Played on {value}",
+                            description=format_plays(plays),
+                            footer={"text": f"{len(plays)} play(s) from listening history"}
+                        )
+                        self.send_message(channel_id, "", embed=embed)
+                        return
+                    
+                    # Answer from local history; fall back to Spotify until the first sync has run
+                    plays = listening_history.last(value)
+                    if not plays:
+                        recent_tracks = spotify_loop.run(aspotify.current_user_recently_played(limit=min(value, 50)))
+                        plays = recent_tracks['items']
                     
-                    if not recent_tracks['items']:
+                    if not plays:
                         self.send_message(channel_id, "No recently played tracks found.")
                         return
                     
-                    track = recent_tracks['items'][0]['track']
-                    played_at = recent_tracks['items'][0]['played_at']
+                    if value > 1:
+                        embed = self.create_embed(
+                            title=f"📼 Last {len(plays)} Played Songs",
+                            description=format_plays(plays),
+                            footer={"text": "Powered by Spotify API"}
+                        )
+                        self.send_message(channel_id, "", embed=embed)
+                        return
+                    
+                    track = plays[0]['track']
+                    played_at = plays[0]['played_at']
                     
                     played_time = datetime.fromisoformat(played_at.replace('Z', '+00:00'))
                     formatted_time = played_time.strftime("%Y-%m-%d %H:%M:%S")
@@ -264,7 +512,7 @@ class SimpleDiscordBot:
                     return
                 
                 try:
-                    current_track = sp.current_playback()
+                    current_track = spotify_loop.run(playback_watcher.current())
                     
                     if not current_track or not current_track['is_playing']:
                         self.send_message(channel_id, "🎵 No song is currently playing.")
@@ -296,10 +544,28 @@ class SimpleDiscordBot:
                     self.send_message(channel_id, f"❌ Error fetching current song: {str(e)}")
                     print(f"Error in nowplaying command: {e}")
             
+            elif command == "stats":
+                try:
+                    title, description = render_stats(listening_stats, args)
+                except ValueError as e:
+                    self.send_message(channel_id, f"❌ {e}")
+                    return
+                except Exception as e:
+                    self.send_message(channel_id, f"❌ Error computing listening stats: {str(e)}")
+                    print(f"Error in stats command: {e}")
+                    return
+                
+                embed = self.create_embed(
+                    title=title,
+                    description=description,
+                    footer={"text": "From local listening history"}
+                )
+                self.send_message(channel_id, "", embed=embed)
+            
             elif command == "spotify_status":
                 if sp:
                     try:
-                        user = sp.current_user()
+                        user = spotify_loop.run(aspotify.current_user())
                         self.send_message(channel_id, f"✅ Spotify connected! Logged in as: **{user['display_name']}**")
                     except Exception as e:
                         self.send_message(channel_id, f"❌ Spotify client error: {str(e)}")
@@ -316,58 +582,69 @@ class SimpleDiscordBot:
         """Run the bot with polling"""
         print("🤖 Starting simple Discord bot...")
         
-        # Get guilds (servers) the bot is in
-        guilds = self.get_guilds()
-        if not guilds:
-            print("❌ Bot is not in any servers!")
-            return
-        
-        print(f"✅ Bot is in {len(guilds)} server(s)")
-        
-        # Get all text channels from all guilds
-        all_channels = []
-        for guild in guilds:
-            guild_id = guild['id']
-            channels = self.get_channels(guild_id)
-            text_channels = [ch for ch in channels if ch['type'] == 0]  # 0 = text channel
-            all_channels.extend(text_channels)
-        
-        if not all_channels:
-            print("❌ No text channels found!")
-            return
-        
-        print(f"✅ Monitoring {len(all_channels)} text channel(s)")
+        # Discover guilds (servers) and their text channels; refreshed while running
+        if not self.discover_channels():
+            print("⚠️  Bot is not in any servers yet, will keep checking...")
+        elif not self.directory.channels:
+            print("⚠️  No text channels found yet, will keep checking...")
+        else:
+            print(f"✅ Monitoring {len(self.directory.channels)} text channel(s)")
         
         if sp:
             try:
-                user = sp.current_user()
+                user = spotify_loop.run(aspotify.current_user())
                 print(f"✅ Spotify connected! Logged in as: {user['display_name']}")
             except Exception as e:
                 print(f"⚠️  Spotify client error: {e}")
+            # Refresh the token ahead of expiry and keep playback state warm so commands answer from memory
+            token_manager.start(spotify_loop.loop)
+            playback_watcher.start(spotify_loop.loop)
+            history_ingester.start(spotify_loop.loop)
         else:
             print("❌ Spotify client failed to initialize!")
         
         print("🎵 Bot is ready! Commands available:")
         print("- !hello")
-        print("- !lastplayed")
+        print("- !lastplayed [count | YYYY-MM-DD]")
         print("- !nowplaying")
+        print("- !stats [artists | tracks | daily | hourly | streak] [window]")
         print("- !spotify_status")
-        print("\nPolling for messages every 5 seconds...")
+        print(f"\nPolling active channels every {POLL_MIN_INTERVAL:g}s, idle ones backing off to {POLL_MAX_INTERVAL:g}s "
+              f"({POLL_CONCURRENCY} channels at a time)...")
         
         # Poll for messages
         while True:
             try:
-                for channel in all_channels:
-                    channel_id = channel['id']
-                    messages = self.get_messages(channel_id, limit=5)
-                    
+                if self.directory.needs_refresh():
+                    self.discover_channels()
+                
+                channel_ids = self.scheduler.due_channels()
+                
+                # Fetch concurrently, then handle commands on this thread in channel order
+                results = self.poll_channels(channel_ids)
+                for channel_id in channel_ids:
+                    messages = results.get(channel_id, [])
                     for message in messages:
                         self.handle_command(message)
+                    
+                    had_command = any(
+                        m.get('content', '').startswith('!') and not m.get('author', {}).get('bot', False)
+                        for m in messages
+                    )
+                    self.scheduler.record(channel_id, bool(messages), had_command)
+                    
+                    if self.directory.is_forbidden(channel_id):
+                        # Dropped until its negative cache entry expires and discovery re-adds it
+                        self.directory.channels.pop(channel_id, None)
+                        self.channel_cursors.pop(channel_id, None)
+                        self.scheduler.remove(channel_id)
                 
-                time.sleep(5)  # Poll every 5 seconds
+                # Sleep until the next channel is due, but never spin or miss a refresh
+                time.sleep(max(0.5, min(self.scheduler.seconds_until_next(), self.directory.refresh_interval)))
                 
             except KeyboardInterrupt:
                 print("\n👋 Bot stopped by user.")
+                self.executor.shutdown(wait=False, cancel_futures=True)
                 break
             except Exception as e:
                 print(f"❌ Polling error: {e}")
@@ -0,0 +1,180 @@
+"""
+Local listening history built from Spotify's recently played endpoint
+A background ingester pages new plays into SQLite with the `after` cursor, keeping history past Spotify's 50-play window
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+
+HISTORY_DB_PATH = os.getenv("HISTORY_DB", "listening_history.db")
+INGEST_INTERVAL = 120  # Seconds between syncs; Spotify only keeps the last 50 plays, so stay well under that
+RECENTLY_PLAYED_PAGE = 50  # Spotify's maximum page size
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plays (
+    played_at TEXT PRIMARY KEY,
+    played_at_ms INTEGER NOT NULL,
+    track_id TEXT,
+    track_name TEXT NOT NULL,
+    artist_id TEXT,
+    artist_name TEXT,
+    duration_ms INTEGER,
+    track_json TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plays_played_at_ms ON plays (played_at_ms);
+"""
+
+def parse_played_at(played_at):
+    """Spotify's ISO 8601 played_at as an aware UTC datetime"""
+    return datetime.fromisoformat(played_at.replace('Z', '+00:00'))
+
+class ListeningHistory:
+    """SQLite store of plays, deduplicated by played_at"""
+
+    def __init__(self, db_path=HISTORY_DB_PATH):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock:
+            self.db.executescript(SCHEMA)
+
+    def add_plays(self, items):
+        """Store recently played items; returns how many were new"""
+        rows = []
+        for item in items:
+            track = item['track']
+            played_at = item['played_at']
+            artist = track['artists'][0] if track['artists'] else {}
+            rows.append((
+                played_at,
+                int(parse_played_at(played_at).timestamp() * 1000),
+                track.get('id'),
+                track['name'],
+                artist.get('id'),
+                artist.get('name'),
+                track.get('duration_ms'),
+                json.dumps(track)
+            ))
+
+        with self.lock, self.db:
+            before = self.db.total_changes
+            self.db.executemany("INSERT OR IGNORE INTO plays VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            return self.db.total_changes - before
+
+    def latest_played_ms(self):
+        """Unix ms of the newest stored play, the cursor for the next sync"""
+        with self.lock:
+            row = self.db.execute("SELECT MAX(played_at_ms) FROM plays").fetchone()
+        return row[0]
+
+    def query(self, sql, params=()):
+        """Plays as recently played items ({'track': ..., 'played_at': ...})"""
+        with self.lock:
+            rows = self.db.execute(f"SELECT played_at, track_json FROM plays {sql}", params).fetchall()
+        return [{'played_at': played_at, 'track': json.loads(track_json)} for played_at, track_json in rows]
+
+    def tracks(self):
+        """Each distinct track in the history, as its stored track object"""
+        with self.lock:
+            rows = self.db.execute("SELECT track_json FROM plays GROUP BY COALESCE(track_id, track_name)").fetchall()
+        return [json.loads(track_json) for track_json, in rows]
+
+    def stats_rows(self):
+        """(played_at_ms, track key, track label, artist key, artist name, duration_ms) per play, oldest first"""
+        with self.lock:
+            return self.db.execute("""
+                SELECT played_at_ms,
+                       COALESCE(track_id, track_name),
+                       track_name || ' — ' || COALESCE(artist_name, 'Unknown'),
+                       COALESCE(artist_id, artist_name, 'Unknown'),
+                       COALESCE(artist_name, 'Unknown'),
+                       duration_ms
+                FROM plays ORDER BY played_at_ms
+            """).fetchall()
+
+    def last(self, n=1):
+        """The n most recent plays, newest first"""
+        return self.query("ORDER BY played_at_ms DESC LIMIT ?", (n,))
+
+    def on_date(self, day):
+        """Plays on a UTC calendar date, oldest first"""
+        start = datetime(day.year, day.month, day.day, tzinfo=timezone.utc)
+        end = start + timedelta(days=1)
+        return self.query("WHERE played_at_ms >= ? AND played_at_ms < ? ORDER BY played_at_ms",
+                          (int(start.timestamp() * 1000), int(end.timestamp() * 1000)))
+
+class HistoryIngester:
+    """Pages new plays from Spotify into the history store in the background"""
+
+    def __init__(self, spotify, history, track_index=None):
+        self.spotify = spotify
+        self.history = history
+        self.track_index = track_index  # track_index.TrackIndex to feed with newly played tracks
+        self.task = None
+
+    def start(self, loop=None):
+        """Start syncing on the given loop (default: the running one); safe to call more than once"""
+        if self.task is None:
+            loop = loop or asyncio.get_running_loop()
+            self.task = asyncio.run_coroutine_threadsafe(self.run(), loop)
+
+    async def sync(self):
+        """Fetch every play newer than the stored cursor; returns how many were added"""
+        loop = asyncio.get_running_loop()
+        after = await loop.run_in_executor(None, self.history.latest_played_ms)
+        added = 0
+        while True:
+            # Bypass the read cache: the cursor changes every page
+            page = await self.spotify.request("GET", "/me/player/recently-played",
+                                              params={"limit": RECENTLY_PLAYED_PAGE, "after": after or 0})
+            items = page['items'] if page else []
+            if not items:
+                break
+            added += await loop.run_in_executor(None, self.history.add_plays, items)
+            if self.track_index is not None:
+                self.track_index.add_tracks(item['track'] for item in items)
+
+            cursor = (page.get('cursors') or {}).get('after')
+            if len(items) < RECENTLY_PLAYED_PAGE or not cursor or int(cursor) == after:
+                break
+            after = int(cursor)
+        return added
+
+    async def run(self):
+        while True:
+            try:
+                added = await self.sync()
+                if added:
+                    print(f"📼 Stored {added} new play(s) in listening history")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️  History sync error: {e}")
+            await asyncio.sleep(INGEST_INTERVAL)
+
+def parse_lastplayed_args(args):
+    """`!lastplayed` arguments: nothing, a count, or a YYYY-MM-DD date -> ('last', n) or ('date', date)"""
+    args = (args or "").strip()
+    if not args:
+        return 'last', 1
+    if args.isdigit():
+        return 'last', max(1, min(int(args), 25))
+    try:
+        return 'date', datetime.strptime(args, "%Y-%m-%d").date()
+    except ValueError:
+        raise ValueError("Usage: `!lastplayed`, `!lastplayed <count>` or `!lastplayed <YYYY-MM-DD>`")
+
+def format_plays(items, limit=25):
+    """One line per play for list embeds, capped to stay within Discord's embed size"""
+    lines = []
+    for item in items[:limit]:
+        track = item['track']
+        played_time = parse_played_at(item['played_at']).strftime("%Y-%m-%d %H:%M")
+        artist = track['artists'][0]['name'] if track['artists'] else "Unknown"
+        lines.append(f"`{played_time}` **{track['name']}** — {artist}")
+    if len(items) > limit:
+        lines.append(f"…and {len(items) - limit} more")
+    return "\n".join(lines)
@@ -1,62 +1,67 @@
 #!/usr/bin/env python3
 """
 Main entry point for the Fidelity Discord bot
-This script ensures Spotify authentication is set up before running the Discord bot.
+Checks the cached Spotify token once, runs setup only if there isn't a usable one, then starts the bot in this same process.
 """
 
-import subprocess
-import sys
+import json
 import os
+import runpy
+import sys
 from pathlib import Path
 
-def run_script(script_name):
-    """Run a Python script and return success status"""
-    try:
-        print(f"🔄 Running {script_name}...")
-        result = subprocess.run([sys.executable, script_name], 
-                              capture_output=False, 
-                              text=True, 
-                              check=True)
-        print(f"✅ {script_name} completed successfully!")
+from dotenv import load_dotenv
+
+from spotify_auth import SPOTIFY_CACHE_PATH
+
+# Bot versions main.py can start, chosen with BOT_FRONTEND
+FRONTENDS = ('fidelity_simple', 'fidelity_http', 'fidelity', 'fidelity_no_voice')
+DEFAULT_FRONTEND = 'fidelity_simple'  # Polling version, no WebSocket or audio dependencies
+
+def cached_token_usable():
+    """Whether the bots can start without setup: a SPOTIFY_TOKEN or a cache file with a refresh token"""
+    if os.getenv("SPOTIFY_TOKEN"):
         return True
-    except subprocess.CalledProcessError as e:
-        print(f"❌ {script_name} failed with exit code {e.returncode}")
-        return False
-    except FileNotFoundError:
-        print(f"❌ {script_name} not found!")
+    try:
+        with open(SPOTIFY_CACHE_PATH) as f:
+            token_info = json.load(f)
+    except (OSError, ValueError):
         return False
+    # An expired access token is fine; the bots refresh it on startup
+    return bool(token_info.get('refresh_token'))
 
 def main():
     """Main function that orchestrates the setup and bot startup"""
     print("🎵 Fidelity Discord Bot")
     print("=" * 40)
-    
-    # Check if we're in the right directory
-    current_dir = Path.cwd()
-    print(f"📁 Working directory: {current_dir}")
-    
+    load_dotenv()
+
+    frontend = os.getenv("BOT_FRONTEND", DEFAULT_FRONTEND)
+    if frontend not in FRONTENDS:
+        print(f"❌ Unknown BOT_FRONTEND {frontend!r}. Choose one of: {', '.join(FRONTENDS)}")
+        return False
+
     # Check if required files exist
-    required_files = ['setup_spotify.py', 'fidelity_simple.py']
-    missing_files = [f for f in required_files if not Path(f).exists()]
-    
-    if missing_files:
-        print(f"❌ Missing required files: {missing_files}")
+    if not Path(f"{frontend}.py").exists():
+        print(f"❌ {frontend}.py not found!")
         print("Please make sure you're in the correct directory.")
         return False
-    
-    # Step 1: Run Spotify setup
-    print("\n🔧 Step 1: Setting up Spotify authentication...")
-    if not run_script('setup_spotify.py'):
-        print("❌ Spotify setup failed. Cannot continue.")
-        return False
-    
-    # Step 2: Run the Discord bot (using simple polling version)
-    print("\n🤖 Step 2: Starting Discord bot...")
-    if not run_script('fidelity_simple.py'):
-        print("❌ Discord bot failed to start.")
-        return False
-    
-    print("\n✅ All done! The bot should now be running.")
+
+    # Step 1: Spotify authentication, only when there's no usable token
+    if cached_token_usable():
+        print("\n✅ Step 1: Found Spotify token, skipping setup")
+    else:
+        print("\n🔧 Step 1: Setting up Spotify authentication...")
+        from setup_spotify import setup_spotify
+        if not setup_spotify():
+            print("❌ Spotify setup failed. Cannot continue.")
+            return False
+
+    # Step 2: Run the Discord bot in this interpreter, reusing the modules already imported
+    print(f"\n🤖 Step 2: Starting Discord bot ({frontend})...")
+    runpy.run_module(frontend, run_name="__main__")
+
+    print("\n✅ All done! The bot has stopped.")
     return True
 
 if __name__ == "__main__":
@@ -69,4 +74,4 @@ if __name__ == "__main__":
         sys.exit(0)
     except Exception as e:
         print(f"\n❌ Unexpected error: {e}")
-        sys.exit(1) 
\ No newline at end of file
+        sys.exit(1)
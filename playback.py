@@ -0,0 +1,98 @@
+"""
+Background watcher that keeps the latest Spotify playback state in memory
+Commands read the snapshot instead of calling Spotify, and polling follows the track rather than command volume
+"""
+
+import asyncio
+import time
+
+PLAYING_INTERVAL = 30  # Seconds between polls mid-track, to notice skips and pauses (progress is extrapolated)
+PAUSED_INTERVAL = 60  # Seconds between polls while paused or nothing is active
+ERROR_INTERVAL = 15  # Seconds to wait after a failed poll
+TRACK_END_GRACE = 0.5  # Seconds past the expected end of a track before polling for the next one
+MAX_SNAPSHOT_AGE = 90  # Seconds before a snapshot is too old to serve (must exceed the poll intervals)
+
+class PlaybackSnapshot:
+    """A current_playback response plus when it was fetched, for extrapolating progress"""
+
+    def __init__(self, state, fetched_at=None):
+        self.state = state  # None when nothing is active
+        self.fetched_at = time.monotonic() if fetched_at is None else fetched_at
+
+    @property
+    def age(self):
+        return time.monotonic() - self.fetched_at
+
+    @property
+    def is_playing(self):
+        return bool(self.state and self.state.get('is_playing') and self.state.get('item'))
+
+    def progress_ms(self):
+        """Playback position now, advanced by the time since the fetch while playing"""
+        progress = self.state.get('progress_ms') or 0
+        if not self.is_playing:
+            return progress
+        return min(self.state['item']['duration_ms'], progress + int(self.age * 1000))
+
+    def remaining_ms(self):
+        return self.state['item']['duration_ms'] - self.progress_ms()
+
+    def track_ended(self):
+        """Whether the extrapolated position has run past the end of the track"""
+        return self.is_playing and self.remaining_ms() <= 0
+
+    def current_state(self):
+        """The playback response with progress_ms extrapolated to now"""
+        if not self.state:
+            return self.state
+        return {**self.state, 'progress_ms': self.progress_ms()}
+
+class PlaybackWatcher:
+    """Polls current playback in the background and serves the latest snapshot"""
+
+    def __init__(self, spotify):
+        self.spotify = spotify
+        self.snapshot = None  # PlaybackSnapshot from the last successful poll
+        self.task = None
+
+    def start(self, loop=None):
+        """Start polling on the given loop (default: the running one); safe to call more than once"""
+        if self.task is None:
+            loop = loop or asyncio.get_running_loop()
+            self.task = asyncio.run_coroutine_threadsafe(self.run(), loop)
+
+    async def refresh(self):
+        """Fetch playback now, bypassing the read cache"""
+        state = await self.spotify.request("GET", "/me/player")
+        self.snapshot = PlaybackSnapshot(state)
+        return self.snapshot
+
+    async def current(self, max_age=MAX_SNAPSHOT_AGE):
+        """Latest playback state with extrapolated progress; fetched live if the snapshot is older than max_age or the track ended"""
+        # Writes based on the current track should pass max_age=0, since a skip only shows up on the next poll
+        snapshot = self.snapshot
+        if snapshot is None or snapshot.age > max_age or snapshot.track_ended():
+            snapshot = await self.refresh()
+        return snapshot.current_state()
+
+    def next_interval(self):
+        """Seconds until the next poll, based on where playback is"""
+        snapshot = self.snapshot
+        if snapshot is None or not snapshot.is_playing:
+            return PAUSED_INTERVAL
+
+        # Poll right after the track should end so the snapshot flips to the next one promptly
+        remaining = snapshot.remaining_ms() / 1000
+        return max(1, min(PLAYING_INTERVAL, remaining + TRACK_END_GRACE))
+
+    async def run(self):
+        while True:
+            try:
+                await self.refresh()
+                interval = self.next_interval()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️  Playback watcher error: {e}")
+                interval = ERROR_INTERVAL
+            await asyncio.sleep(interval)
@@ -0,0 +1,195 @@
+"""
+Shared Discord playlist helpers
+PlaylistIndex keeps the playlist's track URIs in memory for duplicate checks, re-paging only when the snapshot_id changes
+PlaylistWriter coalesces adds that arrive close together into one playlist_add_items call
+"""
+
+import asyncio
+
+PLAYLIST_ID = "6SgFT2PKfNovHZpP1Egow7"  # The shared Discord playlist
+BATCH_WINDOW = 2.0  # Seconds to collect adds before writing
+MAX_BATCH = 100  # Spotify's limit on URIs per playlist_add_items call
+PAGE_SIZE = 100  # Spotify's maximum playlist_items page
+SYNC_INTERVAL = 60  # Seconds between snapshot_id checks
+# Only what the indexes need from each page
+ITEM_FIELDS = "total,items(track(uri,id,name,duration_ms,artists(id,name),album(id,name,images),external_urls))"
+
+async def playlist_pages(spotify, playlist_id, fields=None, page_size=PAGE_SIZE):
+    """Yield the playlist's items one page at a time, fetching the next page while the caller handles this one"""
+    async def fetch(offset):
+        return await spotify.playlist_items(playlist_id, limit=page_size, offset=offset, fields=fields)
+
+    pending = asyncio.ensure_future(fetch(0))
+    offset = 0
+    try:
+        while pending is not None:
+            page = await pending
+            items = page.get('items') or []
+            offset += len(items)
+            # Only one page in flight and one being handled, however long the playlist is
+            pending = asyncio.ensure_future(fetch(offset)) if items and offset < page.get('total', 0) else None
+            if items:
+                yield items
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+class PlaylistIndex:
+    """In-memory set of the playlist's track URIs, kept in step with Spotify via snapshot_id"""
+
+    def __init__(self, spotify, playlist_id, track_index=None):
+        self.spotify = spotify
+        self.playlist_id = playlist_id
+        self.track_index = track_index  # track_index.TrackIndex to feed with the playlist's tracks
+        self.uris = set()
+        self.snapshot_id = None  # Version of the playlist the set reflects; None until first built
+        self.syncing = None  # Task for the sync in flight, shared by every caller
+        self.task = None
+
+    def start(self, loop=None):
+        """Build the index and keep checking it on the given loop (default: the running one)"""
+        if self.task is None:
+            loop = loop or asyncio.get_running_loop()
+            self.task = asyncio.run_coroutine_threadsafe(self.run(), loop)
+
+    async def contains(self, uri):
+        """Whether the track is already in the playlist; only waits on Spotify before the first build"""
+        if self.snapshot_id is None:
+            try:
+                await self.sync()
+            except Exception as e:
+                # Without an index we can't tell, so let the add go ahead rather than fail it
+                print(f"⚠️  Playlist index unavailable, skipping duplicate check: {e}")
+                return False
+        return uri in self.uris
+
+    def __contains__(self, uri):
+        return uri in self.uris
+
+    async def sync(self):
+        """Check the snapshot_id and re-page the playlist only if it changed; concurrent callers share one sync"""
+        if self.syncing is None or self.syncing.done():
+            self.syncing = asyncio.ensure_future(self.rebuild_if_changed())
+        return await asyncio.shield(self.syncing)
+
+    async def rebuild_if_changed(self):
+        """Returns True if the index was rebuilt"""
+        playlist = await self.spotify.playlist(self.playlist_id, fields="snapshot_id")
+        snapshot_id = playlist['snapshot_id']
+        if snapshot_id == self.snapshot_id:
+            return False
+
+        uris = set()
+        async for items in playlist_pages(self.spotify, self.playlist_id, fields=ITEM_FIELDS):
+            # Tracks that are no longer available come back as null
+            tracks = [item['track'] for item in items if item.get('track')]
+            uris.update(track['uri'] for track in tracks)
+            if self.track_index is not None:
+                self.track_index.add_tracks(tracks)
+
+        # Tagged with the snapshot read before paging, so edits made while paging trigger another rebuild next check
+        self.uris = uris
+        self.snapshot_id = snapshot_id
+        print(f"📇 Indexed {len(uris)} track(s) in playlist {self.playlist_id}")
+        return True
+
+    def record_add(self, uris, snapshot_id, base_snapshot_id):
+        """Apply one of our own writes without re-paging; base_snapshot_id is the playlist's snapshot just before it"""
+        if self.snapshot_id is None:
+            return  # Not built yet; the first sync will see these tracks
+        self.uris.update(uris)
+        # The returned snapshot also covers edits made in the Spotify app since the last sync, so only adopt it if the
+        # index was current before the write; otherwise stay stale and let the next check rebuild
+        if snapshot_id and base_snapshot_id == self.snapshot_id:
+            self.snapshot_id = snapshot_id
+
+    async def run(self):
+        while True:
+            try:
+                await self.sync()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️  Playlist index sync error: {e}")
+            await asyncio.sleep(SYNC_INTERVAL)
+
+class PlaylistWriter:
+    """Write-behind queue that batches playlist adds and resolves each caller once its batch commits"""
+
+    def __init__(self, spotify, playlist_id, window=BATCH_WINDOW, index=None):
+        self.spotify = spotify
+        self.playlist_id = playlist_id
+        self.window = window
+        self.index = index  # PlaylistIndex to skip tracks already in the playlist and record new ones
+        self.pending = []  # (uri, future) in arrival order
+        self.full = None  # Event set when a whole batch is waiting, to skip the rest of the window
+        self.flusher = None
+
+    async def add(self, uri):
+        """Queue a track URI and wait until it's written; returns the playlist snapshot_id"""
+        return (await self.add_many([uri]))[0]
+
+    async def add_many(self, uris):
+        """Queue several URIs and wait until all of them are written"""
+        loop = asyncio.get_running_loop()
+        futures = []
+        for uri in uris:
+            future = loop.create_future()
+            self.pending.append((uri, future))
+            futures.append(future)
+
+        if self.full is None:
+            self.full = asyncio.Event()
+        if len(self.pending) >= MAX_BATCH:
+            self.full.set()
+        if self.flusher is None or self.flusher.done():
+            self.flusher = loop.create_task(self.run())
+
+        return await asyncio.gather(*futures)
+
+    async def run(self):
+        while self.pending:
+            # Let adds accumulate for the window unless a full batch is already waiting
+            if len(self.pending) < MAX_BATCH:
+                try:
+                    await asyncio.wait_for(self.full.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+            self.full.clear()
+
+            batch, self.pending = self.pending[:MAX_BATCH], self.pending[MAX_BATCH:]
+            await self.commit(batch)
+
+    async def commit(self, batch):
+        """Write one batch and settle every caller's future"""
+        # The same song requested twice in one window only needs adding once
+        uris = list(dict.fromkeys(uri for uri, _ in batch))
+        if self.index is not None:
+            # An earlier batch may have added it since the caller checked
+            uris = [uri for uri in uris if uri not in self.index]
+            if not uris:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_result(self.index.snapshot_id)
+                return
+        base_snapshot_id = None
+        if self.index is not None:
+            try:
+                base_snapshot_id = (await self.spotify.playlist(self.playlist_id, fields="snapshot_id"))['snapshot_id']
+            except Exception as e:
+                print(f"⚠️  Couldn't read playlist snapshot before writing: {e}")
+        try:
+            result = await self.spotify.playlist_add_items(self.playlist_id, uris)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        print(f"➕ Added {len(uris)} track(s) to playlist {self.playlist_id} in one request")
+        snapshot_id = (result or {}).get('snapshot_id')
+        if self.index is not None:
+            self.index.record_add(uris, snapshot_id, base_snapshot_id)
+        for _, future in batch:
+            if not future.done():
+                future.set_result(snapshot_id)
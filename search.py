@@ -0,0 +1,120 @@
+"""
+Track search with a normalized-query cache
+Requests that differ only in case, spacing or punctuation share one cached Spotify search, stored as compact track objects
+"""
+
+import asyncio
+import os
+import re
+import unicodedata
+
+from spotify_cache import TTLCache
+
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "1024"))  # Distinct queries kept, least recently used evicted first
+SEARCH_CACHE_TTL = 6 * 3600  # Seconds; search results change slowly, but new releases should show up the same day
+SEARCH_LIMIT = 5
+RESOLVE_CONCURRENCY = 8  # Searches in flight at once when resolving many queries
+EMBED_FIELD_LIMIT = 1024  # Discord's maximum length of an embed field value
+MAX_LINE_LENGTH = 200  # Longer lines (long classical or compilation titles) are cut so several still fit
+
+def normalize_query(query):
+    """Cache key form of a query: case-folded, accents and separator punctuation dropped, whitespace collapsed"""
+    text = unicodedata.normalize("NFKD", query).casefold()
+    text = "".join(ch for ch in text if not unicodedata.combining(ch))
+    text = re.sub(r"['’`]", "", text)  # don't -> dont, not don t
+    text = re.sub(r"(?<=\w)[./](?=\w)", "", text)  # AC/DC -> acdc, R.E.M. -> rem
+    text = re.sub(r"[^\w\s+#$!)]+", " ", text)  # Keep symbols that are part of names: C++, P!nk, Ke$ha, Sunn O)))
+    return " ".join(text.split())
+
+def compact_track(track):
+    """Just the track fields the bots read, in the same shape as Spotify's track object"""
+    album = track.get('album') or {}
+    return {
+        'id': track.get('id'),
+        'uri': track['uri'],
+        'name': track['name'],
+        'duration_ms': track.get('duration_ms'),
+        'artists': [{'id': artist.get('id'), 'name': artist['name']} for artist in track.get('artists') or []],
+        'album': {
+            'id': album.get('id'),
+            'name': album.get('name'),
+            'images': (album.get('images') or [])[:1]
+        },
+        'external_urls': {'spotify': (track.get('external_urls') or {}).get('spotify')}
+    }
+
+def format_lines(lines, limit=10, max_length=EMBED_FIELD_LIMIT):
+    """Up to `limit` lines plus an "…and N more" line, kept within an embed field's character limit"""
+    shown = []
+    length = 0
+    for line in lines[:limit]:
+        if len(line) > MAX_LINE_LENGTH:
+            line = line[:MAX_LINE_LENGTH - 1] + "…"
+        # Leave room for the "…and N more" line in case this is the last one that fits
+        if length + len(line) + len(f"\n…and {len(lines)} more") > max_length:
+            break
+        shown.append(line)
+        length += len(line) + 1
+    if len(lines) > len(shown):
+        shown.append(f"…and {len(lines) - len(shown)} more")
+    return "\n".join(shown)
+
+def format_tracks(tracks, limit=10):
+    """One line per track for embed fields, capped to stay within Discord's field size"""
+    return format_lines([f"**{track['name']}** — {track['artists'][0]['name'] if track['artists'] else 'Unknown'}"
+                         for track in tracks], limit)
+
+class TrackSearch:
+    """Spotify track search behind an LRU/TTL cache keyed by the normalized query"""
+
+    def __init__(self, spotify, maxsize=SEARCH_CACHE_SIZE, ttl=SEARCH_CACHE_TTL, index=None):
+        self.spotify = spotify
+        self.ttl = ttl
+        self.cache = TTLCache(maxsize=maxsize)
+        self.index = index  # track_index.TrackIndex consulted before searching and fed with every result
+
+    async def resolve(self, query, spotify=None):
+        """The single best track for a query: a confident local match, else Spotify's top result (searched with `spotify` if given)"""
+        if self.index is not None:
+            track = self.index.match(query)
+            if track is not None:
+                return track
+        tracks = await self.search(query, spotify=spotify)
+        return tracks[0] if tracks else None
+
+    async def resolve_many(self, queries, concurrency=RESOLVE_CONCURRENCY, spotify=None):
+        """Resolve queries concurrently, in order; each result is a track, None, or the exception it raised"""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def resolve_one(query):
+            async with semaphore:
+                return await self.resolve(query, spotify=spotify)
+
+        return await asyncio.gather(*(resolve_one(query) for query in queries), return_exceptions=True)
+
+    async def search(self, query, limit=SEARCH_LIMIT, spotify=None):
+        """Best matching tracks for a query, best first, as compact track objects"""
+        # Only the cache key is normalized; Spotify gets the query as typed, so field filters
+        # (artist:, track:) and names like "P!nk" or "C++" keep their meaning
+        key = (normalize_query(query) or query.strip(), limit)
+        return await self.cache.get_or_fetch(key, self.ttl, lambda: self.fetch(query.strip(), limit, spotify))
+
+    async def fetch(self, query, limit, spotify=None):
+        results = await (spotify or self.spotify).search(q=query, type='track', limit=limit)
+        tracks = [compact_track(track) for track in results['tracks']['items'] if track]
+        if self.index is not None:
+            self.index.add_tracks(tracks)
+        return tracks
+
+    def stats(self):
+        """Counters for tuning the cache size"""
+        lookups = self.cache.hits + self.cache.misses
+        return {
+            'hits': self.cache.hits,
+            'misses': self.cache.misses,
+            'hit_rate': self.cache.hits / lookups if lookups else 0.0,
+            'size': len(self.cache),
+            'capacity': self.cache.maxsize,
+            'local_matches': self.index.local_matches if self.index is not None else 0,
+            'indexed': len(self.index) if self.index is not None else 0
+        }
@@ -0,0 +1,153 @@
+"""
+Per-Discord-user Spotify accounts
+Tokens are kept per Discord user ID in SQLite, and each linked user gets their own async client with a background-refreshed token
+"""
+
+import asyncio
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+from spotify_async import AsyncSpotify
+from spotify_auth import TokenManager, authorize_url, exchange_code
+
+ACCOUNTS_DB_PATH = os.getenv("SPOTIFY_ACCOUNTS_DB", "spotify_accounts.db")
+USER_SCOPE = "user-read-recently-played user-read-currently-playing user-read-playback-state"
+USER_CONCURRENCY = 2  # Calls in flight per linked account; each account has its own rate limit
+LINK_TIMEOUT = 600  # Seconds a !link URL stays valid
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS accounts (
+    user_id TEXT PRIMARY KEY,
+    token_json TEXT NOT NULL,
+    linked_at INTEGER NOT NULL
+);
+"""
+
+class AccountStore:
+    """SQLite token store keyed by Discord user ID"""
+
+    def __init__(self, db_path=ACCOUNTS_DB_PATH):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        with self.lock:
+            self.db.executescript(SCHEMA)
+
+    def save(self, user_id, token_info):
+        """Insert or update one user's token; a refresh only rewrites that row"""
+        with self.lock, self.db:
+            self.db.execute("""
+                INSERT INTO accounts VALUES (?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET token_json = excluded.token_json
+            """, (user_id, json.dumps(token_info), int(time.time())))
+
+    def delete(self, user_id):
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM accounts WHERE user_id = ?", (user_id,))
+
+    def tokens(self):
+        """Token info of every linked user, keyed by user ID"""
+        with self.lock:
+            return {user_id: json.loads(token_json)
+                    for user_id, token_json in self.db.execute("SELECT user_id, token_json FROM accounts")}
+
+class UserTokenManager(TokenManager):
+    """TokenManager whose token lives in one row of the account store instead of the cache file"""
+
+    def __init__(self, client_id, client_secret, store, user_id, token_info):
+        self.store = store
+        self.user_id = user_id
+        self.initial_token = token_info  # Read from the store by the caller, off the event loop
+        super().__init__(client_id, client_secret, cache_path=None)
+
+    def load(self):
+        return self.initial_token
+
+    def persist(self):
+        self.store.save(self.user_id, self.token_info)
+
+class SpotifyAccounts:
+    """Pool of per-user clients, looked up by Discord user ID"""
+
+    def __init__(self, client_id, client_secret, redirect_uri, store=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.redirect_uri = redirect_uri
+        self.store = store or AccountStore()
+        self.clients = {}  # user_id -> AsyncSpotify
+        self.pending_links = {}  # state -> (user_id, monotonic deadline)
+
+    async def start(self):
+        """Create a client for every linked user; each keeps its own token fresh on the running loop"""
+        tokens = await asyncio.get_running_loop().run_in_executor(None, self.store.tokens)
+        for user_id, token_info in tokens.items():
+            if user_id not in self.clients:
+                self.add_client(user_id, token_info)
+
+    def add_client(self, user_id, token_info):
+        tokens = UserTokenManager(self.client_id, self.client_secret, self.store, user_id, token_info)
+        client = AsyncSpotify(tokens, concurrency=USER_CONCURRENCY)
+        tokens.start()
+        self.clients[user_id] = client
+        return client
+
+    def client(self, user_id):
+        """The user's own client, or None if they haven't linked an account (or its access was revoked)"""
+        user_id = str(user_id)
+        client = self.clients.get(user_id)
+        if client is not None and client.tokens.revoked:
+            self.evict(user_id)
+            return None
+        return client
+
+    def evict(self, user_id):
+        """Drop a user whose refresh token Spotify rejected, so their commands fall back to the bot account"""
+        print(f"❌ Spotify access revoked for Discord user {user_id}; unlinking until they !link again")
+        client = self.clients.pop(user_id)
+        loop = asyncio.get_running_loop()
+        loop.create_task(client.close())
+        loop.run_in_executor(None, self.store.delete, user_id)
+
+    def link_url(self, user_id):
+        """Consent URL tied to this user by a one-time state value"""
+        now = time.monotonic()
+        self.pending_links = {state: link for state, link in self.pending_links.items() if link[1] > now}
+        state = secrets.token_urlsafe(16)
+        self.pending_links[state] = (str(user_id), now + LINK_TIMEOUT)
+        return authorize_url(self.client_id, self.redirect_uri, USER_SCOPE, state)
+
+    async def link(self, user_id, redirect_url):
+        """Finish linking from the URL Spotify redirected to; returns the user's Spotify profile"""
+        user_id = str(user_id)
+        query = parse_qs(urlparse(redirect_url.strip()).query)
+        code = (query.get("code") or [None])[0]
+        state = (query.get("state") or [None])[0]
+        if query.get("error"):
+            raise ValueError(f"Spotify didn't authorize the link ({query['error'][0]}).")
+        if not code or not state:
+            raise ValueError("That doesn't look like the URL Spotify redirected you to. Copy the whole address.")
+
+        link = self.pending_links.get(state)
+        if link is None or link[0] != user_id or link[1] < time.monotonic():
+            raise ValueError("This link has expired or belongs to someone else. Run `!link` again.")
+        del self.pending_links[state]
+
+        token_info = await exchange_code(self.client_id, self.client_secret, code, self.redirect_uri)
+        await self.unlink(user_id)
+        await asyncio.get_running_loop().run_in_executor(None, self.store.save, user_id, token_info)
+        return await self.add_client(user_id, token_info).current_user()
+
+    async def unlink(self, user_id):
+        """Forget the user's account; returns whether one was linked"""
+        user_id = str(user_id)
+        client = self.clients.pop(user_id, None)
+        if client is not None:
+            if client.tokens.task is not None:
+                client.tokens.task.cancel()
+            await client.close()
+        await asyncio.get_running_loop().run_in_executor(None, self.store.delete, user_id)
+        return client is not None
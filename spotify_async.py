@@ -0,0 +1,134 @@
+"""
+Asyncio Spotify Web API client
+Covers the endpoints the bots use over one pooled keep-alive session, so many calls can share one event loop
+"""
+
+import asyncio
+import threading
+
+import aiohttp
+
+from spotify_cache import TTLCache
+
+SPOTIFY_API_BASE = "https://api.spotify.com/v1"
+MAX_RETRIES = 3  # Attempts per request on 429 / 5xx / expired token
+REQUEST_TIMEOUT = 15  # Seconds
+# How long each read endpoint's responses are served from cache, in seconds
+CACHE_TTLS = {
+    "current_playback": 3,
+    "recently_played": 15,
+    "current_user": 600,
+}
+
+class SpotifyAPIError(Exception):
+    """Error response from the Spotify Web API"""
+
+    def __init__(self, status, message):
+        self.status = status
+        # Same leading format as spotipy's SpotifyException, which the commands match on
+        super().__init__(f"http status: {status}, {message}")
+
+class AsyncSpotify:
+    """Spotify Web API client built on one pooled aiohttp session"""
+
+    def __init__(self, tokens, concurrency=8):
+        self.tokens = tokens  # spotify_auth.TokenManager, which keeps the access token fresh
+        self.concurrency = concurrency
+        self.session = None
+        self.semaphore = None
+        self.cache = TTLCache()
+
+    def ensure_session(self):
+        """Create the pooled session on first use, inside the running loop"""
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60)
+            self.session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+            )
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        return self.session
+
+    async def close(self):
+        if self.session and not self.session.closed:
+            await self.session.close()
+
+    async def request(self, method, path, params=None, json=None):
+        """Send an API request and return the decoded JSON body, or None if there is none"""
+        session = self.ensure_session()
+        if params:
+            params = {key: value for key, value in params.items() if value is not None}
+
+        async with self.semaphore:
+            for attempt in range(MAX_RETRIES):
+                headers = {"Authorization": f"Bearer {await self.tokens.access_token()}"}
+                async with session.request(method, f"{SPOTIFY_API_BASE}{path}",
+                                           params=params, json=json, headers=headers) as response:
+                    if response.status == 429:
+                        retry_after = float(response.headers.get("Retry-After", 1))
+                        print(f"⏳ Spotify rate limited {path}, retrying in {retry_after:g}s")
+                        await asyncio.sleep(retry_after)
+                        continue
+                    if response.status == 401 and attempt == 0:
+                        # Token was revoked or expired early; refresh once and retry
+                        await self.tokens.refresh()
+                        continue
+                    if response.status >= 500 and attempt < MAX_RETRIES - 1:
+                        await asyncio.sleep(2 ** attempt)
+                        continue
+                    if response.status >= 400:
+                        raise SpotifyAPIError(response.status, await response.text())
+                    if response.status == 204 or response.content_length == 0:
+                        return None
+                    return await response.json()
+
+            raise SpotifyAPIError(response.status, f"{path} failed after {MAX_RETRIES} attempts")
+
+    async def cached_get(self, endpoint, path, params=None):
+        """GET through the read cache, with concurrent identical calls sharing one request"""
+        key = (endpoint, tuple(sorted((params or {}).items())))
+        return await self.cache.get_or_fetch(key, CACHE_TTLS[endpoint], lambda: self.request("GET", path, params=params))
+
+    async def current_playback(self, market=None):
+        """Current playback state, or None if nothing is active"""
+        return await self.cached_get("current_playback", "/me/player", params={"market": market})
+
+    async def current_user_recently_played(self, limit=50, after=None, before=None):
+        """Recently played tracks; after/before are Unix timestamps in milliseconds"""
+        return await self.cached_get("recently_played", "/me/player/recently-played",
+                                     params={"limit": limit, "after": after, "before": before})
+
+    async def search(self, q, limit=10, offset=0, type="track", market=None):
+        return await self.request("GET", "/search",
+                                  params={"q": q, "limit": limit, "offset": offset, "type": type, "market": market})
+
+    async def playlist(self, playlist_id, fields=None):
+        """Playlist object; pass fields (e.g. "snapshot_id") to fetch only part of it"""
+        return await self.request("GET", f"/playlists/{playlist_id}", params={"fields": fields})
+
+    async def playlist_items(self, playlist_id, limit=100, offset=0, fields=None):
+        """One page of a playlist's items (at most 100 per call)"""
+        return await self.request("GET", f"/playlists/{playlist_id}/tracks",
+                                  params={"limit": limit, "offset": offset, "fields": fields})
+
+    async def playlist_add_items(self, playlist_id, items, position=None):
+        """Add track URIs to a playlist (at most 100 per call)"""
+        body = {"uris": list(items)}
+        if position is not None:
+            body["position"] = position
+        return await self.request("POST", f"/playlists/{playlist_id}/tracks", json=body)
+
+    async def current_user(self):
+        return await self.cached_get("current_user", "/me")
+
+class BackgroundLoop:
+    """Event loop on a daemon thread, for calling async clients from threaded code"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="spotify-loop", daemon=True)
+        self.thread.start()
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the loop and block the calling thread until it finishes"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
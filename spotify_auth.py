@@ -0,0 +1,191 @@
+"""
+In-memory Spotify token store with proactive background refresh
+Doubles as a spotipy cache handler, so the sync and async clients share one token without re-reading disk
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+import aiohttp
+from spotipy.cache_handler import CacheHandler
+
+from spotify_async import SpotifyAPIError
+
+SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
+SPOTIFY_AUTHORIZE_URL = "https://accounts.spotify.com/authorize"
+SPOTIFY_CACHE_PATH = ".spotify_cache"
+REFRESH_AHEAD = 300  # Refresh this many seconds before the access token expires
+EXPIRY_SKEW = 10  # A token this close to expiry is treated as expired and refreshed inline
+RETRY_INTERVAL = 30  # Seconds between attempts after a failed background refresh
+
+def authorize_url(client_id, redirect_uri, scope, state):
+    """Spotify consent page for the authorization code flow"""
+    return f"{SPOTIFY_AUTHORIZE_URL}?" + urlencode({
+        "client_id": client_id,
+        "response_type": "code",
+        "redirect_uri": redirect_uri,
+        "scope": scope,
+        "state": state,
+    })
+
+async def exchange_code(client_id, client_secret, code, redirect_uri):
+    """Trade an authorization code for token info (with expires_at, like spotipy's cache)"""
+    data = {
+        "grant_type": "authorization_code",
+        "code": code,
+        "redirect_uri": redirect_uri
+    }
+    auth = aiohttp.BasicAuth(client_id, client_secret)
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15)) as session:
+        async with session.post(SPOTIFY_TOKEN_URL, data=data, auth=auth) as response:
+            if response.status != 200:
+                raise SpotifyAPIError(response.status, f"authorization failed: {await response.text()}")
+            token_info = await response.json()
+
+    token_info['expires_at'] = int(time.time()) + token_info['expires_in']
+    return token_info
+
+def token_error(body):
+    """OAuth error code from a token endpoint error response, e.g. "invalid_grant", or None"""
+    try:
+        return json.loads(body).get('error')
+    except (ValueError, AttributeError):
+        return None
+
+class TokenManager(CacheHandler):
+    """Holds the Spotify token in memory, refreshes it ahead of expiry and persists it atomically"""
+
+    def __init__(self, client_id, client_secret, cache_path=SPOTIFY_CACHE_PATH):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.cache_path = cache_path
+        self.file_lock = threading.Lock()
+        self.token_info = self.load()
+        self.refreshing = None  # Task for the refresh in flight, shared by every caller
+        self.task = None
+        self.cleared = False  # Set by clear(); nothing is refreshed or written back after that
+        self.revoked = False  # Set when Spotify rejects the refresh token; only a new login can fix that
+
+    def load(self):
+        """Read the persisted token once at startup"""
+        try:
+            with open(self.cache_path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def persist(self):
+        """Write the token to the cache file via a temp file and rename, so readers never see half a file"""
+        if self.cleared:
+            return
+        directory = os.path.dirname(os.path.abspath(self.cache_path))
+        with self.file_lock:
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".spotify_cache.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as f:
+                    json.dump(self.token_info, f)
+                os.replace(tmp_path, self.cache_path)
+            except Exception:
+                os.unlink(tmp_path)
+                raise
+
+    # spotipy CacheHandler interface
+    def get_cached_token(self):
+        return self.token_info
+
+    def save_token_to_cache(self, token_info):
+        if self.cleared:
+            return
+        self.token_info = token_info
+        try:
+            self.persist()
+        except (OSError, sqlite3.Error) as e:
+            print(f"⚠️  Couldn't persist Spotify token: {e}")
+
+    def clear(self):
+        """Forget the token for good so the next start has to re-authenticate"""
+        self.cleared = True
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        self.token_info = None
+
+    def seconds_left(self):
+        return self.token_info['expires_at'] - time.time()
+
+    async def access_token(self):
+        """Current access token; only waits on a refresh if the background one fell behind"""
+        if self.token_info is None:
+            raise SpotifyAPIError(401, "no Spotify token; re-authenticate and restart the bot")
+        if self.seconds_left() <= EXPIRY_SKEW:
+            await self.refresh()
+        return self.token_info['access_token']
+
+    async def refresh(self):
+        """Refresh now; concurrent callers share one request"""
+        if self.refreshing is None or self.refreshing.done():
+            self.refreshing = asyncio.ensure_future(self.request_token())
+        return await asyncio.shield(self.refreshing)
+
+    async def request_token(self):
+        """Exchange the refresh token for a new access token"""
+        data = {
+            "grant_type": "refresh_token",
+            "refresh_token": self.token_info['refresh_token']
+        }
+        auth = aiohttp.BasicAuth(self.client_id, self.client_secret)
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15)) as session:
+            async with session.post(SPOTIFY_TOKEN_URL, data=data, auth=auth) as response:
+                if response.status != 200:
+                    body = await response.text()
+                    # Only invalid_grant means the refresh token itself was revoked; other 400s (invalid_client
+                    # after a secret rotation, say) are config problems a retry can recover from once fixed
+                    if response.status == 400 and token_error(body) == "invalid_grant":
+                        self.revoked = True
+                    raise SpotifyAPIError(response.status, f"token refresh failed: {body}")
+                token_info = await response.json()
+
+        if self.cleared:
+            raise SpotifyAPIError(401, "Spotify token was cleared; re-authenticate and restart the bot")
+        token_info['expires_at'] = int(time.time()) + token_info['expires_in']
+        # Spotify only sometimes rotates the refresh token
+        token_info.setdefault('refresh_token', self.token_info['refresh_token'])
+        self.token_info = token_info
+        print("🔄 Refreshed Spotify access token")
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.persist)
+        except (OSError, sqlite3.Error) as e:  # sqlite3 for stores like spotify_accounts.AccountStore
+            print(f"⚠️  Couldn't persist Spotify token: {e}")
+        return token_info
+
+    def start(self, loop=None):
+        """Start refreshing in the background on the given loop (default: the running one)"""
+        if self.task is None and self.token_info:
+            loop = loop or asyncio.get_running_loop()
+            self.task = asyncio.run_coroutine_threadsafe(self.run(), loop)
+
+    async def run(self):
+        while True:
+            delay = self.seconds_left() - REFRESH_AHEAD
+            if delay > 0:
+                # Re-check after waking in case something else refreshed meanwhile
+                await asyncio.sleep(delay)
+                continue
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.revoked:
+                    # The refresh token was revoked, so retrying can't succeed
+                    print(f"❌ Spotify refresh token rejected, stopping background refresh: {e}")
+                    return
+                print(f"⚠️  Background Spotify token refresh failed: {e}")
+                await asyncio.sleep(RETRY_INTERVAL)
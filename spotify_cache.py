@@ -0,0 +1,75 @@
+"""
+Read-through cache for Spotify API responses
+Entries expire after a per-call TTL, and concurrent misses on one key share a single upstream request
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+
+class TTLCache:
+    """Async TTL cache with single-flight coalescing of concurrent misses"""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()  # key -> (monotonic expiry, value), least recently used first
+        self.inflight = {}  # key -> fetch Task shared by every caller waiting on the same fetch
+        self.hits = 0  # get_or_fetch calls answered without a new fetch (including ones joining a fetch in flight)
+        self.misses = 0  # get_or_fetch calls that had to fetch
+
+    def get(self, key):
+        """Cached value for a key, or None if it's missing or expired"""
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self.entries[key]
+            return None
+        self.entries.move_to_end(key)
+        return value
+
+    def __len__(self):
+        return len(self.entries)
+
+    def set(self, key, value, ttl):
+        self.entries[key] = (time.monotonic() + ttl, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Drop one key, or everything"""
+        if key is None:
+            self.entries.clear()
+        else:
+            self.entries.pop(key, None)
+
+    async def get_or_fetch(self, key, ttl, fetch):
+        """Return the cached value, or await fetch() once no matter how many callers miss together"""
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+        task = self.inflight.get(key)
+        if task is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            # The fetch runs as its own task, so cancelling whichever caller started it doesn't fail the rest
+            task = self.inflight[key] = asyncio.ensure_future(self.fetch_into(key, ttl, fetch))
+            # Mark the error retrieved so a fetch whose callers were all cancelled doesn't log "never retrieved"
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        # Shield so one waiter being cancelled doesn't cancel the shared fetch
+        return await asyncio.shield(task)
+
+    async def fetch_into(self, key, ttl, fetch):
+        """Run one fetch, cache its value and clear the in-flight entry"""
+        try:
+            value = await fetch()
+            self.set(key, value, ttl)
+            return value
+        finally:
+            del self.inflight[key]
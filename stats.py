@@ -0,0 +1,203 @@
+"""
+Listening statistics over the local history store
+History is loaded into NumPy columns (int-coded track/artist IDs, timestamps, durations) and aggregated with vectorized group-bys
+"""
+
+import re
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+
+MS_PER_HOUR = 3_600_000
+MS_PER_DAY = 86_400_000
+WINDOW_UNITS = {"d": MS_PER_DAY, "w": 7 * MS_PER_DAY, "m": 30 * MS_PER_DAY, "y": 365 * MS_PER_DAY}
+DEFAULT_WINDOW = "30d"
+TOP_N = 10
+STATS_USAGE = "Usage: `!stats [artists | tracks | daily | hourly | streak] [7d | 4w | 6m | 1y | all]`"
+
+class HistoryFrame:
+    """Columnar listening history: one array element per play"""
+
+    def __init__(self, played_at_ms, track_codes, artist_codes, duration_ms, track_names, artist_names):
+        self.played_at_ms = played_at_ms  # int64
+        self.track_codes = track_codes  # int64 index into track_names
+        self.artist_codes = artist_codes  # int64 index into artist_names
+        self.duration_ms = duration_ms  # float64
+        self.track_names = track_names
+        self.artist_names = artist_names
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from (played_at_ms, track_key, track_label, artist_key, artist_name, duration_ms) rows"""
+        if not rows:
+            empty = np.zeros(0, dtype=np.int64)
+            return cls(empty, empty, empty, np.zeros(0), np.array([], dtype=object), np.array([], dtype=object))
+
+        played_at_ms, track_keys, track_labels, artist_keys, artist_labels, duration_ms = zip(*rows)
+        track_names, track_codes = cls.encode(track_keys, track_labels)
+        artist_names, artist_codes = cls.encode(artist_keys, artist_labels)
+        return cls(
+            np.fromiter(played_at_ms, dtype=np.int64, count=len(rows)),
+            track_codes,
+            artist_codes,
+            np.array([d or 0 for d in duration_ms], dtype=np.float64),
+            track_names,
+            artist_names
+        )
+
+    @staticmethod
+    def encode(keys, labels):
+        """Int-code keys; returns (label per code, code per row)"""
+        uniques, first_index, codes = np.unique(np.array(keys, dtype=object), return_index=True, return_inverse=True)
+        return np.array(labels, dtype=object)[first_index], codes.astype(np.int64)
+
+    def __len__(self):
+        return len(self.played_at_ms)
+
+    def since(self, start_ms):
+        """Plays at or after start_ms, sharing the same code tables"""
+        mask = self.played_at_ms >= start_ms
+        return HistoryFrame(self.played_at_ms[mask], self.track_codes[mask], self.artist_codes[mask],
+                            self.duration_ms[mask], self.track_names, self.artist_names)
+
+    def total_minutes(self):
+        return self.duration_ms.sum() / 60_000
+
+    def top(self, codes, names, n=TOP_N):
+        """(name, plays, minutes) for the n most played codes"""
+        plays = np.bincount(codes, minlength=len(names))
+        minutes = np.bincount(codes, weights=self.duration_ms, minlength=len(names)) / 60_000
+        order = np.argsort(-plays, kind="stable")[:n]
+        order = order[plays[order] > 0]
+        return [(names[i], int(plays[i]), float(minutes[i])) for i in order]
+
+    def top_artists(self, n=TOP_N):
+        return self.top(self.artist_codes, self.artist_names, n)
+
+    def top_tracks(self, n=TOP_N):
+        return self.top(self.track_codes, self.track_names, n)
+
+    def day_numbers(self):
+        """UTC day number (days since the epoch) of each play"""
+        return self.played_at_ms // MS_PER_DAY
+
+    def minutes_per_day(self):
+        """(day numbers, minutes) for each UTC day with at least one play"""
+        days, inverse = np.unique(self.day_numbers(), return_inverse=True)
+        return days, np.bincount(inverse, weights=self.duration_ms) / 60_000
+
+    def minutes_per_hour(self):
+        """Minutes listened in each UTC hour of the day (24 values)"""
+        hours = (self.played_at_ms // MS_PER_HOUR) % 24
+        return np.bincount(hours, weights=self.duration_ms, minlength=24) / 60_000
+
+    def streaks(self, today=None):
+        """(longest, current) runs of consecutive UTC days with plays"""
+        days = np.unique(self.day_numbers())
+        if len(days) == 0:
+            return 0, 0
+
+        # A new run starts wherever the gap to the previous day isn't exactly one
+        starts = np.flatnonzero(np.diff(days) != 1) + 1
+        bounds = np.concatenate(([0], starts, [len(days)]))
+        lengths = np.diff(bounds)
+
+        today = int(time.time() * 1000) // MS_PER_DAY if today is None else today
+        # The current streak survives until a full day passes without plays
+        current = int(lengths[-1]) if days[-1] >= today - 1 else 0
+        return int(lengths.max()), current
+
+class ListeningStats:
+    """Caches the history as a HistoryFrame, rebuilding only when new plays arrive"""
+
+    def __init__(self, history):
+        self.history = history
+        self.frame = None
+        self.frame_version = None
+
+    def load(self):
+        version = self.history.latest_played_ms()
+        if self.frame is None or version != self.frame_version:
+            self.frame = HistoryFrame.from_rows(self.history.stats_rows())
+            self.frame_version = version
+        return self.frame
+
+    def window(self, spec):
+        """Frame for a window like '7d', '4w', '6m', '1y' or 'all'"""
+        frame = self.load()
+        if spec == "all":
+            return frame
+        return frame.since(int(time.time() * 1000) - parse_window(spec))
+
+def parse_window(spec):
+    """Window length in ms from specs like '7d', '4w', '6m', '1y'"""
+    match = re.fullmatch(r"(\d+)([dwmy])", spec)
+    if not match:
+        raise ValueError(STATS_USAGE)
+    return int(match.group(1)) * WINDOW_UNITS[match.group(2)]
+
+def parse_stats_args(args):
+    """`!stats` arguments -> (report, window)"""
+    report, window = "overview", DEFAULT_WINDOW
+    for arg in (args or "").lower().split():
+        if arg in ("artists", "tracks", "daily", "hourly", "streak", "overview"):
+            report = arg
+        elif arg == "all" or re.fullmatch(r"\d+[dwmy]", arg):
+            window = arg
+        else:
+            raise ValueError(STATS_USAGE)
+    return report, window
+
+def format_day(day_number):
+    return datetime.fromtimestamp(int(day_number) * 86_400, tz=timezone.utc).strftime("%Y-%m-%d")
+
+def format_top(rows):
+    return "\n".join(f"**{i}.** {name} — {plays} plays, {minutes:.0f} min"
+                     for i, (name, plays, minutes) in enumerate(rows, 1))
+
+def render_stats(stats, args):
+    """Build (title, description) for a `!stats` request; raises ValueError on bad arguments"""
+    report, window = parse_stats_args(args)
+    frame = stats.window(window)
+    label = "all time" if window == "all" else f"last {window}"
+
+    if len(frame) == 0:
+        return f"📊 Listening Stats ({label})", "No plays recorded in this window yet."
+
+    if report == "artists":
+        return f"📊 Top Artists ({label})", format_top(frame.top_artists())
+
+    if report == "tracks":
+        return f"📊 Top Tracks ({label})", format_top(frame.top_tracks())
+
+    if report == "daily":
+        days, minutes = frame.minutes_per_day()
+        lines = [f"`{format_day(day)}` {m:.0f} min" for day, m in zip(days[-14:], minutes[-14:])]
+        best = int(np.argmax(minutes))
+        lines.append(f"\nAverage **{minutes.mean():.0f} min** on days you listened; "
+                     f"best day **{format_day(days[best])}** ({minutes[best]:.0f} min)")
+        return f"📊 Minutes per Day ({label}, UTC)", "\n".join(lines)
+
+    if report == "hourly":
+        minutes = frame.minutes_per_hour()
+        scale = minutes.max() or 1
+        lines = [f"`{hour:02d}:00` {'█' * int(round(m / scale * 12)):<12} {m:.0f} min" for hour, m in enumerate(minutes)]
+        return f"📊 Minutes per Hour ({label}, UTC)", "\n".join(lines)
+
+    if report == "streak":
+        longest, current = frame.streaks()
+        return f"📊 Listening Streaks ({label})", f"Current streak: **{current} day(s)**\nLongest streak: **{longest} day(s)**"
+
+    longest, current = frame.streaks()
+    lines = [
+        f"**{len(frame)}** plays, **{frame.total_minutes():.0f}** minutes",
+        f"Current streak **{current}** day(s), longest **{longest}**",
+        "",
+        "**Top artists**",
+        format_top(frame.top_artists(5)),
+        "",
+        "**Top tracks**",
+        format_top(frame.top_tracks(5))
+    ]
+    return f"📊 Listening Stats ({label})", "\n".join(lines)
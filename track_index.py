@@ -0,0 +1,147 @@
+"""
+Local fuzzy index over every track the bot has handled (searches, the shared playlist, listening history)
+Queries are matched by character trigrams of the track name and artists, so a confident match can skip the Spotify search
+"""
+
+import math
+import re
+import threading
+from array import array
+
+from search import compact_track, normalize_query
+
+CONFIDENT_SCORE = 0.9  # Share of the query's trigrams a track must contain to be used without searching Spotify
+MIN_DICE = 0.5  # ...and how much of the track's own text the query must cover, so "love" doesn't pick one "Love Story"
+AMBIGUITY_MARGIN = 0.1  # A different song scoring within this of the best one means the query is ambiguous
+MAX_CANDIDATES = 500  # Queries made only of very common trigrams give up locally instead of scanning the index
+INSERT_CHUNK = 500  # Tracks inserted per hold of the lock, so a bulk load never blocks lookups for long
+
+def trigrams(text):
+    """Trigrams of each word of normalized text, padded so word starts and ends count"""
+    grams = set()
+    for word in text.split():
+        padded = f" {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+def match_text(track):
+    """Normalized name and artists, the part of a track that queries are matched against"""
+    artists = " ".join(artist['name'] for artist in track.get('artists') or [])
+    return normalize_query(f"{track['name']} {artists}")
+
+class TrackIndex:
+    """Trigram inverted index of compact tracks, keyed by URI"""
+
+    def __init__(self):
+        self.lock = threading.Lock()  # History is loaded from an executor while commands read the index
+        self.tracks = []  # doc id -> compact track
+        self.texts = []  # doc id -> match text, space-padded so `gram in text` matches exactly its trigrams
+        self.gram_counts = array('H')  # doc id -> number of distinct trigrams in its match text
+        self.ids = {}  # uri -> doc id
+        self.postings = {}  # trigram -> array of doc ids
+        self.history_loaded = False
+        self.local_matches = 0
+
+    def __len__(self):
+        return len(self.tracks)
+
+    def add_tracks(self, tracks):
+        """Index track objects not seen before; returns how many were new"""
+        # Normalizing and trigramming is the slow part, so it happens outside the lock and only the inserts take it,
+        # a chunk at a time, letting lookups from the event loop through during a long history load
+        added = 0
+        chunk = []
+        for track in tracks:
+            if not track or not track.get('uri') or track['uri'] in self.ids:
+                continue
+            text = match_text(track)
+            if text:
+                chunk.append((track['uri'], compact_track(track), text, trigrams(text)))
+            if len(chunk) >= INSERT_CHUNK:
+                added += self.insert(chunk)
+                chunk = []
+        if chunk:
+            added += self.insert(chunk)
+        return added
+
+    def insert(self, entries):
+        """Add prepared (uri, compact track, match text, trigrams) entries under the lock"""
+        added = 0
+        with self.lock:
+            for uri, track, text, grams in entries:
+                if uri in self.ids:
+                    continue
+                doc_id = len(self.tracks)
+                self.tracks.append(track)
+                self.texts.append(f" {text} ")
+                self.gram_counts.append(min(len(grams), 0xFFFF))
+                self.ids[uri] = doc_id
+                for gram in grams:
+                    postings = self.postings.get(gram)
+                    if postings is None:
+                        postings = self.postings[gram] = array('I')
+                    postings.append(doc_id)
+                added += 1
+        return added
+
+    def load_history(self, history):
+        """Index every distinct track in the listening history, once (blocking; run it in an executor)"""
+        if self.history_loaded:
+            return 0
+        self.history_loaded = True
+        added = self.add_tracks(history.tracks())
+        print(f"🗃️  Indexed {added} track(s) from listening history")
+        return added
+
+    def candidates(self, grams, min_shared):
+        """Doc ids that could share at least min_shared of the query trigrams, or None if there are too many"""
+        lists = sorted((self.postings.get(gram, ()) for gram in grams), key=len)
+        # A doc missing all of the rarest (len - min_shared + 1) trigrams can't reach min_shared, so those lists suffice
+        found = set()
+        for postings in lists[:len(lists) - min_shared + 1]:
+            found.update(postings)
+            if len(found) > MAX_CANDIDATES:
+                return None
+        return found
+
+    def match(self, query):
+        """The track a query clearly refers to, or None if no indexed track is a confident, unambiguous match"""
+        grams = trigrams(normalize_query(query))
+        if not grams:
+            return None
+
+        min_shared = math.ceil(CONFIDENT_SCORE * len(grams))
+        with self.lock:
+            found = self.candidates(grams, min_shared)
+            if not found:
+                return None
+
+            scored = []
+            for doc_id in found:
+                # Query trigrams never have a space in the middle, so a substring test can't match across words
+                text = self.texts[doc_id]
+                shared = sum(gram in text for gram in grams)
+                scored.append((shared / len(grams), 2 * shared / (len(grams) + self.gram_counts[doc_id]), doc_id))
+            scored.sort(reverse=True)
+
+            containment, dice, best = scored[0]
+            if containment < CONFIDENT_SCORE or dice < MIN_DICE:
+                return None
+
+            # Other releases of the same song (single vs album) don't make a query ambiguous
+            best_song = self.song_key(best)
+            for other_containment, _, doc_id in scored[1:]:
+                if other_containment < containment - AMBIGUITY_MARGIN:
+                    break
+                if self.song_key(doc_id) != best_song:
+                    return None
+
+            self.local_matches += 1
+            return self.tracks[best]
+
+    def song_key(self, doc_id):
+        """Name without version suffixes ("- Remastered 2011", "(Live)") plus first artist"""
+        track = self.tracks[doc_id]
+        name = re.split(r" - |[(\[]", track['name'])[0]
+        artist = track['artists'][0]['name'] if track['artists'] else ""
+        return normalize_query(name), normalize_query(artist)